@@ -0,0 +1,423 @@
+# --- benchmark.py: offline load test for bot.py ---
+# Builds a synthetic catalog, swaps the Pyrogram clients for in-process fakes,
+# points Gemini at a local fake server, then replays query / button / indexing
+# traces through the real handlers and reports throughput, p50 and p99.
+#
+#   python benchmark.py                                  # defaults, all scenarios
+#   python benchmark.py --groups 100000 --queries 20000 --concurrency 50
+#   python benchmark.py --gemini-latency 400 --gemini-error-rate 0.05
+#   python benchmark.py --save-baseline bench_baseline.json
+#   python benchmark.py --baseline bench_baseline.json   # shows the change per scenario
+#
+# Runs inside a temporary directory, so the real databases are never touched.
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import re
+import sys
+import tempfile
+import time
+from datetime import datetime
+from types import SimpleNamespace
+
+from aiohttp import web
+
+SCENARIOS = ("search", "callback", "index", "index_batch", "persistence")
+
+# -----------------------------------------------------------------
+# --- 1. SYNTHETIC DATA ---
+# -----------------------------------------------------------------
+
+TITLE_WORDS = (
+    "dark", "night", "return", "king", "queen", "last", "city", "love", "story", "war", "shadow", "river",
+    "fire", "ghost", "secret", "empire", "hunter", "storm", "dream", "legend", "silent", "broken", "golden",
+    "jawan", "pathaan", "animal", "dunki", "tiger", "pushpa", "kalki", "salaar", "leo", "jailer", "devara",
+    "amélie", "café", "señor", "mission", "escape", "planet", "island", "winter", "summer", "road", "code"
+)
+LANGS = ("Hindi", "English", "Tamil", "Telugu", "Malayalam", "Kannada", "Bengali")
+QUALITIES = ("480p", "720p", "1080p", "2160p")
+SOURCES = ("WEB-DL", "BluRay", "WEBRip", "HDRip", "HDTV")
+CODECS = ("x264", "x265", "HEVC", "AVC")
+GROUPS = ("RARBG", "YTS", "PSA", "Pahe", "MkvCinemas", "NTb", "FLUX")
+
+def make_title(rng, n):
+    words = rng.sample(TITLE_WORDS, rng.randint(1, 4))
+    return f"{' '.join(word.capitalize() for word in words)} {n}"
+
+def make_catalog(rng, size, make_group_id):
+    groups = {}
+    for n in range(size):
+        title = make_title(rng, n)
+        languages = {}
+        for lang in rng.sample(LANGS, rng.randint(1, 3)):
+            languages[lang] = {quality: {"fileId": f"F{n}-{lang}-{quality}", "fileName": f"{title}.{quality}.mkv", "fileType": "document"}
+                               for quality in rng.sample(QUALITIES, rng.randint(1, 3))}
+        groups[make_group_id(title)] = {"groupName": title, "searchAll": title.lower(), "languages": languages}
+    return groups
+
+# Roughly what channels post: mostly scene-style names the local parser handles,
+# plus messy ones that need the AI
+def make_file_name(rng, n):
+    title = make_title(rng, n)
+    year = rng.randint(1980, 2025)
+    if rng.random() < 0.7:
+        parts = [*title.split(), str(year), rng.choice(QUALITIES), rng.choice(SOURCES), rng.choice(CODECS)]
+        return f"{'.'.join(parts)}-{rng.choice(GROUPS)}.mkv"
+    return f"@Channel_{rng.randint(1, 99)} {title} ({year}) {rng.choice(LANGS)} Dubbed Full Movie {rng.choice(QUALITIES)}.mp4"
+
+def typo(rng, word):
+    if len(word) < 4: return word
+    i = rng.randrange(1, len(word) - 1)
+    return word[:i] + word[i + 1:] if rng.random() < 0.5 else word[:i] + word[i] + word[i:]
+
+# Mix: plain titles, titles with language/quality words, typos, and misses
+def make_query_trace(rng, groups, count):
+    names = [group["groupName"] for group in rng.sample(list(groups.values()), min(len(groups), 5000))]
+    trace = []
+    for _ in range(count):
+        name = rng.choice(names)
+        words = name.split()[:-1] or name.split()
+        roll = rng.random()
+        if roll < 0.55:
+            trace.append(" ".join(words))
+        elif roll < 0.75:
+            trace.append(f"{' '.join(words)} {rng.choice(LANGS).lower()} {rng.choice(QUALITIES)}")
+        elif roll < 0.9:
+            trace.append(" ".join(typo(rng, word) for word in words))
+        else:
+            trace.append(f"zzqx {rng.randint(0, 10**6)} unknown")
+    return trace
+
+# -----------------------------------------------------------------
+# --- 2. FAKE TELEGRAM ---
+# -----------------------------------------------------------------
+
+class FakeMessage:
+    def __init__(self, client, chat_id, text="", user_id=None, document=None, message_id=0):
+        self.client = client
+        self.id = message_id
+        self.chat = SimpleNamespace(id=chat_id)
+        self.from_user = SimpleNamespace(id=user_id or chat_id)
+        self.text = text
+        self.document = document
+        self.video = None
+        self.date = datetime.now()
+
+    async def reply(self, text, **kwargs):
+        return await self.client.send_message(self.chat.id, text, **kwargs)
+
+    reply_text = reply
+
+    async def edit(self, text, **kwargs):
+        await self.client.call()
+        self.text = text
+        return self
+
+    edit_text = edit
+
+    async def edit_reply_markup(self, reply_markup=None):
+        await self.client.call()
+        return self
+
+    async def delete(self):
+        await self.client.call()
+
+class FakeCallbackQuery:
+    def __init__(self, message, user_id, data):
+        self.message = message
+        self.from_user = SimpleNamespace(id=user_id)
+        self.data = data
+
+    async def answer(self, text=None, show_alert=False):
+        await self.message.client.call()
+
+# Stands in for both bot_app (send_message) and user_app (get_download_link)
+class FakeTelegram:
+    def __init__(self, latency):
+        self.latency = latency
+        self.calls = 0
+        self.sent = []
+
+    async def call(self):
+        self.calls += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+    async def send_message(self, chat_id, text, **kwargs):
+        await self.call()
+        self.sent.append((chat_id, kwargs.get("reply_markup")))
+        if len(self.sent) > 1000:
+            del self.sent[:500]
+        return FakeMessage(self, chat_id, text)
+
+    async def get_download_link(self, file_id):
+        await self.call()
+        return f"https://example.invalid/dl/{file_id}"
+
+# -----------------------------------------------------------------
+# --- 3. FAKE GEMINI ---
+# -----------------------------------------------------------------
+
+QUALITY_RE = re.compile(r'\b(2160p|1080p|720p|480p)\b', re.I)
+LANG_RE = re.compile(r'\b(' + '|'.join(LANGS) + r')\b', re.I)
+YEAR_RE = re.compile(r'[\(\[]?\b(19|20)\d{2}\b')
+
+def fake_file_info(file_name):
+    stem = re.sub(r'^@\w+\s+', '', os.path.splitext(file_name)[0]).replace('.', ' ')
+    title = YEAR_RE.split(stem)[0].strip(" -([") or stem
+    quality = QUALITY_RE.search(stem)
+    lang = LANG_RE.search(stem)
+    return {"groupName": title, "lang": lang.group(1).capitalize() if lang else "Unknown", "quality": quality.group(1).lower() if quality else "SD"}
+
+class FakeGemini:
+    def __init__(self, latency, error_rate, seed):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.rng = random.Random(seed)
+        self.requests = 0
+        self.errors = 0
+
+    async def handle(self, request):
+        self.requests += 1
+        payload = await request.json()
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if self.rng.random() < self.error_rate:
+            self.errors += 1
+            return web.Response(status=503, text="overloaded")
+
+        prompt = payload["contents"][0]["parts"][0]["text"]
+        schema = payload.get("generationConfig", {}).get("responseSchema")
+        names = re.findall(r'^\d+\. "(.*)"$', prompt, re.M)
+        if schema and schema.get("type") == "ARRAY":
+            answer = json.dumps([fake_file_info(name) for name in names])
+        elif schema:
+            answer = json.dumps(fake_file_info(re.search(r'Analyze: "(.*)"\.', prompt).group(1)))
+        else:
+            answer = "Some Unknown Title" # Search fallback: a title that isn't in the catalog
+        return web.json_response({"candidates": [{"content": {"parts": [{"text": answer}]}}]})
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_post('/{tail:.*}', self.handle)
+        self.runner = web.AppRunner(app, access_log=None)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, "127.0.0.1", 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        return f"http://127.0.0.1:{port}/v1beta/models/fake:generateContent"
+
+    async def close(self):
+        await self.runner.cleanup()
+
+# -----------------------------------------------------------------
+# --- 4. SCENARIOS ---
+# -----------------------------------------------------------------
+
+def percentile(sorted_values, fraction):
+    if not sorted_values: return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(fraction * len(sorted_values)))]
+
+# Runs `operation(item)` for every item with `concurrency` workers and reports
+# per-operation latency in milliseconds
+async def run_trace(items, operation, concurrency):
+    latencies = []
+    queue = asyncio.Queue()
+    for item in items:
+        queue.put_nowait(item)
+
+    async def worker():
+        while not queue.empty():
+            item = queue.get_nowait()
+            started = time.perf_counter()
+            await operation(item)
+            latencies.append((time.perf_counter() - started) * 1000)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    latencies.sort()
+    return {
+        "ops": len(latencies),
+        "seconds": round(elapsed, 3),
+        "throughput": round(len(latencies) / elapsed, 1) if elapsed else 0.0,
+        "p50_ms": round(percentile(latencies, 0.5), 3),
+        "p99_ms": round(percentile(latencies, 0.99), 3)
+    }
+
+async def bench_search(bot, telegram, rng, args):
+    trace = make_query_trace(rng, bot.files_store.data, args.queries)
+    async def operation(query):
+        user_id = rng.randint(1, 10**6)
+        await bot.handle_user_search(telegram, FakeMessage(telegram, user_id, query))
+    return await run_trace(trace, operation, args.concurrency)
+
+async def bench_callback(bot, telegram, rng, args):
+    trace = []
+    for group_id in rng.choices(list(bot.files_store.data), k=args.queries):
+        group = bot.files_store.data[group_id]
+        lang = rng.choice(list(group["languages"]))
+        quality = rng.choice(list(group["languages"][lang]))
+        trace.append(bot.callback_tokens.issue("qual", group_id, lang, quality) if rng.random() < 0.7 else bot.callback_tokens.issue("lang", group_id, lang))
+    async def operation(token):
+        user_id = rng.randint(1, 10**6)
+        await bot.handle_callback_query(telegram, FakeCallbackQuery(FakeMessage(telegram, user_id), user_id, token))
+    return await run_trace(trace, operation, args.concurrency)
+
+def make_file_messages(telegram, rng, count, offset):
+    return [FakeMessage(telegram, -100, message_id=offset + n, document=SimpleNamespace(
+                file_name=make_file_name(rng, offset + n), file_id=f"NEW{offset + n}",
+                file_unique_id=f"U{offset + n}", file_size=rng.randint(10**8, 4 * 10**9)))
+            for n in range(count)]
+
+async def bench_index(bot, telegram, rng, args):
+    messages = make_file_messages(telegram, rng, args.files, 10**7)
+    return await run_trace(messages, bot.process_file_for_indexing, args.concurrency)
+
+async def bench_index_batch(bot, telegram, rng, args):
+    messages = make_file_messages(telegram, rng, args.files, 2 * 10**7)
+    batches = [messages[i:i + bot.INDEX_BATCH_SIZE] for i in range(0, len(messages), bot.INDEX_BATCH_SIZE)]
+    result = await run_trace(batches, bot.process_files_for_indexing, args.concurrency)
+    result["files_per_second"] = round(len(messages) / result["seconds"], 1) if result["seconds"] else 0.0
+    return result
+
+# One op = STORE_DIRTY_THRESHOLD writes followed by a flush to the backend
+PERSISTENCE_MIN_ROUNDS = 20 # Enough samples for p50/p99 to mean something
+
+async def bench_persistence(bot, telegram, rng, args):
+    store = bot.files_store
+    group_ids = list(store.data)
+    rounds = max(PERSISTENCE_MIN_ROUNDS, args.queries // bot.STORE_DIRTY_THRESHOLD)
+    async def operation(_):
+        for group_id in rng.choices(group_ids, k=bot.STORE_DIRTY_THRESHOLD):
+            group = store.get(group_id)
+            store.set(group_id, {**group, "touchedAt": time.time()})
+        await store.flush()
+    return await run_trace(range(rounds), operation, 1)
+
+BENCHMARKS = {
+    "search": bench_search,
+    "callback": bench_callback,
+    "index": bench_index,
+    "index_batch": bench_index_batch,
+    "persistence": bench_persistence
+}
+
+# -----------------------------------------------------------------
+# --- 5. SETUP, REPORTING & MAIN ---
+# -----------------------------------------------------------------
+
+def load_bot(args, workdir):
+    os.chdir(workdir)
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    import bot
+    if not args.verbose:
+        logging.getLogger("bot").setLevel(logging.CRITICAL)
+    if args.storage != bot.STORAGE_BACKEND:
+        bot.STORAGE_BACKEND = args.storage
+        for store in bot.ALL_STORES:
+            store.backend = bot.make_backend(store.name, bot.STORE_PATHS[store.name], catalog=store is bot.files_store)
+    return bot
+
+async def setup(bot, args, rng):
+    telegram = FakeTelegram(args.telegram_latency / 1000)
+    bot.bot_app.send_message = telegram.send_message
+    bot.user_app.get_download_link = telegram.get_download_link
+    bot.user_app.is_connected = True # Skip the lazy login in ensure_user_app()
+    bot.YOUR_BLOGGER_AD_PAGE_URL = "https://bench.invalid/ad-page.html" # Else send_ad_link stops at its config check
+
+    gemini = FakeGemini(args.gemini_latency / 1000, args.gemini_error_rate, args.seed)
+    bot.GEMINI_API_URL = bot.GEMINI_API_URL_WITH_SEARCH = await gemini.start()
+
+    for store in bot.ALL_STORES:
+        store.load()
+    started = time.perf_counter()
+    bot.files_store.data = make_catalog(rng, args.groups, bot.make_group_id)
+    generated = time.perf_counter()
+    bot.request_registry.load()
+    if isinstance(bot.files_store.backend, bot.SqliteBackend): # Searches read its FTS table, not SearchIndex
+        bot.files_store.backend.write_sync([["s", group_id, group] for group_id, group in bot.files_store.items()])
+    else:
+        bot.search_index.rebuild(bot.files_store.items())
+    bot.fuzzy_matcher.rebuild(bot.files_store.items())
+    bot.file_id_index.rebuild(bot.files_store.items())
+    setup_report = {
+        "catalog_generate_seconds": round(generated - started, 3),
+        "catalog_index_seconds": round(time.perf_counter() - generated, 3)
+    }
+    return telegram, gemini, setup_report
+
+def format_report(report, baseline=None):
+    lines = [f"{'scenario':<12} {'ops':>8} {'ops/s':>10} {'p50 ms':>10} {'p99 ms':>10}" + ("   vs baseline (ops/s, p99)" if baseline else "")]
+    for name, result in report["scenarios"].items():
+        line = f"{name:<12} {result['ops']:>8} {result['throughput']:>10} {result['p50_ms']:>10} {result['p99_ms']:>10}"
+        before = (baseline or {}).get("scenarios", {}).get(name)
+        if before:
+            change = lambda new, old: f"{(new - old) / old * 100:+.1f}%" if old else "n/a"
+            line += f"   {change(result['throughput'], before['throughput']):>8} {change(result['p99_ms'], before['p99_ms']):>8}"
+        lines.append(line)
+    for key, value in report["setup"].items():
+        lines.append(f"{key}: {value}")
+    return "\n".join(lines)
+
+async def run(bot, args):
+    rng = random.Random(args.seed)
+    telegram, gemini, setup_report = await setup(bot, args, rng)
+    report = {"config": vars(args).copy(), "setup": setup_report, "scenarios": {}}
+    try:
+        for name in args.scenarios:
+            report["scenarios"][name] = await BENCHMARKS[name](bot, telegram, rng, args)
+            print(f"... {name} done", file=sys.stderr)
+    finally:
+        report["setup"]["gemini_requests"] = gemini.requests
+        report["setup"]["gemini_errors"] = gemini.errors
+        report["setup"]["telegram_calls"] = telegram.calls
+        await gemini.close()
+        for store in bot.ALL_STORES:
+            await store.close()
+        await bot.gemini_cache.close()
+        await bot.http_client.close()
+    return report
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Offline throughput/latency benchmark for bot.py")
+    parser.add_argument("--groups", type=int, default=10000, help="Synthetic catalog size (groups)")
+    parser.add_argument("--queries", type=int, default=5000, help="Searches / button presses replayed")
+    parser.add_argument("--files", type=int, default=1000, help="File names indexed")
+    parser.add_argument("--concurrency", type=int, default=20, help="Operations in flight at once")
+    parser.add_argument("--gemini-latency", type=float, default=200, help="Fake Gemini response time (ms)")
+    parser.add_argument("--gemini-error-rate", type=float, default=0.0, help="Fraction of Gemini calls answered with 503")
+    parser.add_argument("--telegram-latency", type=float, default=0, help="Fake Telegram API call time (ms)")
+    parser.add_argument("--storage", choices=("json", "sqlite"), default="json", help="Store backend to benchmark")
+    parser.add_argument("--scenarios", nargs="+", choices=SCENARIOS, default=list(SCENARIOS))
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--baseline", help="Compare against a report saved with --save-baseline")
+    parser.add_argument("--save-baseline", help="Write this run's report as JSON")
+    parser.add_argument("--verbose", action="store_true", help="Show the bot's own log output")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    baseline = None
+    if args.baseline:
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory(prefix="bot-bench-") as workdir:
+        bot = load_bot(args, workdir)
+        try:
+            # The loop the Pyrogram clients were created on (uvloop when installed)
+            report = bot.bot_app.loop.run_until_complete(run(bot, args))
+        finally:
+            os.chdir(cwd)
+    print(format_report(report, baseline))
+    if args.save_baseline:
+        with open(args.save_baseline, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+
+if __name__ == "__main__":
+    main()
@@ -3,19 +3,49 @@
 
 import logging
 import asyncio
+import base64
+import copy
+import gc
+import hashlib
+import heapq
 import json
+import math
+import multiprocessing
 import os
+import re
+import sqlite3
+import sys
+import time
+import unicodedata
 import aiohttp
 import aiofiles
-from flask import Flask, jsonify, request, abort
-from threading import Thread
-from pyrogram import Client, filters, enums
-from pyrogram.errors import FloodWait
+from aiohttp import web
+from collections import OrderedDict
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from pyrogram import Client, filters, enums, idle
+from pyrogram.errors import FloodWait, RPCError
 from pyrogram.types import (
     InlineKeyboardMarkup, InlineKeyboardButton,
     Message, CallbackQuery
 )
 
+# Optional speedups (both in requirements.txt; the bot runs without them)
+try:
+    import uvloop
+except ImportError:
+    uvloop = None
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+try:
+    import fcntl # Writer lock (not available on Windows)
+except ImportError:
+    fcntl = None
+
+PROCESS_STARTED = time.monotonic()
+
 # -----------------------------------------------------------------
 # --- 1. CONFIGURATION (FILL THIS OUT) ---
 # -----------------------------------------------------------------
@@ -35,12 +65,55 @@ DASHBOARD_URL = "https://YOUR-NETLIFY-SITE.netlify.app/admin_dashboard.html" # P
 API_SECRET_KEY = "your-very-secret-password-123" # CHANGE THIS to a strong password
 SERVER_HOST = "0.0.0.0"            # Run on all IPs
 SERVER_PORT = 3000                 # Port for your API server
+DASHBOARD_CACHE_TTL = 5            # Seconds a dashboard response is reused before being rebuilt
+EXPORT_CHUNK_LINES = 1000          # Records serialized per write of a streaming export
+IMPORT_CHUNK_LINES = 2000          # Records validated and committed per step of a bulk import
+IMPORT_MAX_LINE_BYTES = 1048576    # Longest NDJSON record accepted by an import
 
 # --- Gemini AI Config ---
 GEMINI_API_KEY = "" # Leave as ""
 GEMINI_API_URL = f"https://generativelanguage.googleapis.com/v1beta/models/gemini-2.5-flash-preview-09-2025:generateContent?key={GEMINI_API_KEY}"
 GEMINI_API_URL_WITH_SEARCH = f"https://generativelanguage.googleapis.com/v1beta/models/gemini-2.5-flash-preview-09-2025:generateContent?key={GEMINI_API_KEY}"
 
+# --- HTTP Client Config (shared by all outbound AI calls) ---
+HTTP_POOL_SIZE = 100            # Max open connections overall
+HTTP_POOL_PER_HOST = 20         # Max concurrent requests to one host
+HTTP_DNS_CACHE_TTL = 300        # Seconds to cache DNS lookups
+HTTP_CONNECT_TIMEOUT = 10       # Seconds to establish a connection
+HTTP_READ_TIMEOUT = 60          # Seconds to wait for response data
+HTTP_RETRIES = 3                # Attempts per AI call
+HTTP_BACKOFF = 1.0              # Seconds before the first retry, doubled each time
+
+# --- Indexing Config ---
+INDEX_BATCH_SIZE = 25           # File names classified per Gemini request
+PARSER_MIN_CONFIDENCE = 0.85    # Trust the local file-name parser above this score (0-1), else ask AI
+DUPLICATE_POLICY = "keep_newest" # A different file for a taken group/lang/quality: "keep_newest" or "keep_largest"
+SCRAPE_WORKERS = 4              # Batches classified concurrently during /index
+SCRAPE_QUEUE_SIZE = 8           # Batches buffered between pipeline stages (bounds memory)
+SCRAPE_PROGRESS_INTERVAL = 10   # Seconds between /index progress updates
+INDEX_BUILD_CHUNK = 2000        # Groups indexed between event-loop yields while indexes warm up at startup
+
+# --- Gemini Cache Config ---
+GEMINI_CACHE_MAX_ENTRIES = 5000 # In-memory LRU size (the sqlite tier is unbounded)
+GEMINI_CACHE_TTL = {            # Seconds an answer stays valid, per kind of call
+    "structured": 30 * 86400,   # File-name analysis (/index, channel posts)
+    "text": 7 * 86400,
+    "search": 86400             # Search-grounded suggestions go stale faster
+}
+GEMINI_NEGATIVE_TTL = 60        # Remember failed calls this long (memory only)
+
+# --- Admission Control Config ---
+BOT_WORKERS = 32                # Updates the bot handles at once
+USER_SEARCH_CONCURRENCY = 24    # Of those, max running user searches (the rest stay free for admin commands and buttons)
+USER_SEARCH_RATE = 0.5          # Searches per second a user earns back...
+USER_SEARCH_BURST = 5           # ...up to this many in a row
+AI_FALLBACK_CONCURRENCY = 4     # Gemini search fallbacks running at once
+AI_FALLBACK_MAX_WAITING = 16    # Fallbacks allowed to queue for a slot; beyond that they are refused
+
+# --- Search Worker Config ---
+SEARCH_WORKER_PROCESSES = 0     # 0 = search on the bot's event loop; N = run searches in N processes (one catalog copy each)
+WRITER_LOCK_PATH = './bot.lock' # Held while the bot runs, so a second instance can't write the same databases
+
 # --- Bot Behavior Config ---
 BATCH_PROCESS_DELAY = 5000 # 5 seconds
 IGNORE_WORDS = [
@@ -58,10 +131,63 @@ QUALITY_MAP = {
     '720p': '720p', '480': '480p', '480p': '480p', 'hd': '720p', 'sd': 'SD'
 }
 
+# --- Search Config ---
+SEARCH_TOP_K = 50               # Max groups returned per search (shown RESULTS_PAGE_SIZE at a time)
+RESULTS_PAGE_SIZE = 5           # Groups per page of the search results message
+RESULT_CACHE_TTL = 300          # Seconds a query's ranked results are reused (page flips, repeat queries)
+RESULT_CACHE_MAX_ENTRIES = 2000 # Queries kept in the result cache
+SEARCH_MIN_GRAM = 3             # Shortest word prefix that still matches ("jaw" -> "jawan")
+FUZZY_MIN_SCORE = 0.4           # Trigram similarity (0-1) needed to skip the AI fallback
+FUZZY_TOP_K = 3                 # Max groups suggested by the fuzzy matcher
+CALLBACK_TOKEN_MAX_ENTRIES = 100000 # Button payloads remembered; older buttons answer "expired"
+
+# --- Popularity Config ---
+POPULARITY_FLUSH_INTERVAL = 30  # Seconds between writing buffered click counts to the DB
+POPULARITY_BUCKET_SECONDS = 600 # Granularity of the "trending" counters
+POPULARITY_WINDOWS = {          # Rolling windows shown by /popularity and the dashboard
+    "lastHour": 3600,
+    "lastDay": 86400
+}
+
+# --- Request Registry Config ---
+REQUEST_FILLER_WORDS = {        # Dropped from requested titles, so "Jawan movie" and "jawan" merge
+    "movie", "movies", "film", "full", "hd", "download", "please", "pls", "plz", "new"
+}
+
+# --- Download Link Cache Config ---
+LINK_CACHE_TTL = 3600           # Seconds a generated download link is reused
+LINK_CACHE_MAX_ENTRIES = 2000   # Links kept in memory (least recently used are dropped)
+LINK_PREFETCH_TOP_N = 50        # Keep links warm for this many popular files (0 = off)
+LINK_PREFETCH_INTERVAL = 600    # Seconds between prefetch rounds
+LINK_PREFETCH_SPACING = 1       # Seconds between prefetch lookups, to go easy on the user account
+
+# --- Broadcast Config ---
+BROADCAST_GLOBAL_RATE = 25      # Messages per second across all chats (Telegram allows ~30)
+BROADCAST_BURST = 25            # Messages that may go out back-to-back before throttling
+BROADCAST_PER_CHAT_INTERVAL = 1 # Min seconds between two messages to the same chat
+BROADCAST_CONCURRENCY = 8       # Concurrent senders
+BROADCAST_MAX_ATTEMPTS = 3      # Tries per recipient on network errors (FloodWait doesn't count)
+BROADCAST_CHECKPOINT_EVERY = 50 # Save delivery progress after this many recipients
+BROADCAST_PROGRESS_INTERVAL = 10 # Seconds between progress updates to the admin
+
 # --- Database Paths ---
 DB_PATH_FILES = './file_groups_ai.json'
 DB_PATH_REQUESTS = './requests_v2.json'
 DB_PATH_POPULARITY = './popularity.json'
+DB_PATH_SCRAPE_JOBS = './scrape_jobs.json'
+DB_PATH_BROADCASTS = './broadcasts.json'
+DB_PATH_META = './meta.json'           # Catalog format version and other bookkeeping
+DB_PATH_AI_CACHE = './gemini_cache.sqlite3'
+DB_PATH_SQLITE = './bot.sqlite3'   # Used by all stores when STORAGE_BACKEND = "sqlite"
+
+# --- Storage Config ---
+STORAGE_BACKEND = "json"        # "json" (files below) or "sqlite" (run `python bot.py migrate-sqlite` first)
+CATALOG_CHANGES_KEPT = 100000   # SQLite only: catalog change-log rows kept for search workers to catch up from
+STORE_JOURNAL_INTERVAL = 1      # Seconds between journal appends
+STORE_SNAPSHOT_INTERVAL = 300   # Seconds between snapshots while there are unsaved changes
+STORE_DIRTY_THRESHOLD = 500     # Snapshot early once this many changes pile up
+STORE_BINARY_SNAPSHOTS = True   # Also write "<path>.msgpack" snapshots and start from them (needs msgpack)
+USE_UVLOOP = True               # Run on uvloop when it is installed
 
 # -----------------------------------------------------------------
 # --- 2. INITIALIZE LOGGING, BOTS, & DATABASES ---
@@ -71,39 +197,749 @@ DB_PATH_POPULARITY = './popularity.json'
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
+# --- Metrics (served as Prometheus text on /metrics) ---
+# Counters and histograms are updated inline by the code they measure; gauges
+# are callbacks read at scrape time (see section 8). Labels are passed as
+# keyword arguments and must stay low-cardinality (no titles or user IDs).
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+class Metrics:
+    def __init__(self):
+        self.kinds = {}      # name -> "counter" | "histogram" | "gauge"
+        self.help = {}
+        self.values = {}     # name -> {labels: value} for counters
+        self.histograms = {} # name -> {labels: [bucket counts..., sum, count]}
+        self.buckets = {}
+        self.gauges = {}     # name -> callback returning a number or {labels: number}
+
+    def counter(self, name, help_text):
+        self.kinds[name], self.help[name] = "counter", help_text
+        self.values[name] = {}
+
+    def histogram(self, name, help_text, buckets=LATENCY_BUCKETS):
+        self.kinds[name], self.help[name] = "histogram", help_text
+        self.histograms[name] = {}
+        self.buckets[name] = buckets
+
+    def gauge(self, name, help_text, callback, kind="gauge"):
+        self.kinds[name], self.help[name] = kind, help_text
+        self.gauges[name] = callback
+
+    def inc(self, name, value=1, **labels):
+        key = tuple(sorted(labels.items()))
+        series = self.values[name]
+        series[key] = series.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        key = tuple(sorted(labels.items()))
+        buckets = self.buckets[name]
+        state = self.histograms[name].get(key)
+        if state is None:
+            state = self.histograms[name][key] = [0] * (len(buckets) + 2)
+        for i, bound in enumerate(buckets):
+            if value <= bound:
+                state[i] += 1
+        state[-2] += value
+        state[-1] += 1
+
+    @contextmanager
+    def timer(self, name, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - started, **labels)
+
+    @staticmethod
+    def _labels(key, extra=()):
+        pairs = list(key) + list(extra)
+        if not pairs: return ""
+        return "{" + ",".join(f'{label}="{value}"' for label, value in pairs) + "}"
+
+    def render(self):
+        lines = []
+        for name, kind in self.kinds.items():
+            lines.append(f"# HELP {name} {self.help[name]}")
+            lines.append(f"# TYPE {name} {kind}")
+            if kind == "histogram":
+                buckets = self.buckets[name]
+                for key, state in self.histograms[name].items():
+                    for bound, count in zip(buckets, state):
+                        lines.append(f"{name}_bucket{self._labels(key, [('le', bound)])} {count}")
+                    lines.append(f"{name}_bucket{self._labels(key, [('le', '+Inf')])} {state[-1]}")
+                    lines.append(f"{name}_sum{self._labels(key)} {state[-2]}")
+                    lines.append(f"{name}_count{self._labels(key)} {state[-1]}")
+            elif name in self.gauges:
+                try:
+                    value = self.gauges[name]()
+                except Exception as e:
+                    logger.warning(f"Metrics: gauge {name} failed: {e}")
+                    continue
+                series = value if isinstance(value, dict) else {(): value}
+                for key, number in series.items():
+                    lines.append(f"{name}{self._labels(key)} {number}")
+            else:
+                for key, number in self.values[name].items():
+                    lines.append(f"{name}{self._labels(key)} {number}")
+        return "\n".join(lines) + "\n"
+
+metrics = Metrics()
+metrics.histogram("bot_stage_seconds", "Latency of user-search stages (search, fuzzy, ai_fallback)")
+metrics.histogram("gemini_request_seconds", "Latency of each Gemini HTTP attempt, by status")
+metrics.histogram("store_load_seconds", "Time to load a store at startup")
+metrics.histogram("store_flush_seconds", "Time to persist a store's pending changes")
+metrics.histogram("store_lock_wait_seconds", "Time a store flush waited for the store's I/O lock")
+metrics.histogram("download_link_seconds", "Latency of generating a download link on the user account")
+metrics.histogram("telegram_send_seconds", "Latency of bot send_message calls, by kind and result")
+metrics.histogram("index_batch_seconds", "Time to classify one batch of file names")
+metrics.counter("index_files_total", "Files processed by the indexer, by source and result")
+metrics.counter("telegram_floodwait_total", "FloodWait errors received, by source")
+metrics.counter("telegram_floodwait_seconds_total", "Seconds of FloodWait imposed, by source")
+metrics.counter("admission_rejected_total", "User searches turned away, by reason (rate_limit, overload, ai_overload)")
+metrics.counter("search_coalesced_total", "Searches that waited on an identical search already in flight")
+
+def record_flood_wait(source, error):
+    metrics.inc("telegram_floodwait_total", source=source)
+    metrics.inc("telegram_floodwait_seconds_total", error.value, source=source)
+
+# Must happen before the Clients below grab their event loop
+if USE_UVLOOP and uvloop:
+    uvloop.install()
+    asyncio.set_event_loop(asyncio.new_event_loop()) # uvloop's policy won't create one implicitly
+
 # Initialize Pyrogram Clients
 # Bot Account (for users)
-bot_app = Client("bot_session", bot_token=BOT_TOKEN, api_id=API_ID, api_hash=API_HASH)
-# User Account (for scraping)
+bot_app = Client("bot_session", bot_token=BOT_TOKEN, api_id=API_ID, api_hash=API_HASH, workers=BOT_WORKERS)
+# User Account (for scraping). Connected on first use (see ensure_user_app)
 user_app = Client(SESSION_NAME, api_id=API_ID, api_hash=API_HASH)
+user_app_lock = asyncio.Lock()
+
+async def ensure_user_app():
+    if not user_app.is_connected:
+        async with user_app_lock:
+            if not user_app.is_connected:
+                await user_app.start()
+                mark_startup("userAppStarted")
+    return user_app
+
+# Seconds from process start to each startup phase (logged, and exported on /metrics)
+startup_timings = {}
+
+def mark_startup(phase):
+    startup_timings[phase] = round(time.monotonic() - PROCESS_STARTED, 3)
 
 # Batch processing globals
 admin_batch_queues = {}
 admin_batch_timers = {}
-db_lock = asyncio.Lock() # Lock for thread-safe DB writes
 scrape_lock = asyncio.Lock() # Lock to prevent multiple /index commands at once
 
-# --- Database Functions (with AsyncFile for safety) ---
-async def load_db(path):
-    async with db_lock:
-        if os.path.exists(path):
+# --- Resident Stores (in-memory, write-behind) ---
+# Each database is loaded once at startup and served from memory. Mutations are
+# recorded as ops (["s", key, value], ["d", key], ["c"]) and handed to the
+# store's backend in the background every STORE_JOURNAL_INTERVAL seconds.
+# Values are treated as immutable: copy, change, then set() them back, so
+# backends can serialize them off the event loop without locking readers out.
+#
+# Backends:
+#   JsonBackend   - "<path>" snapshot + append-only "<path>.journal", folded into
+#                   a new snapshot (temp file + rename) on an interval/threshold.
+#                   With STORE_BINARY_SNAPSHOTS, every snapshot is also written as
+#                   "<path>.msgpack", which startup prefers while it is at least
+#                   as new as the JSON file (so hand edits to the JSON still win).
+#   SqliteBackend - one row per key in a WAL-mode database, updated in place.
+#                   The catalog also keeps an FTS5 table over titles and file
+#                   names, which answers searches instead of SearchIndex (so
+#                   that index is never built), and a change log for search
+#                   worker processes.
+class JsonBackend:
+    snapshots = True
+
+    def __init__(self, name, path):
+        self.name = name
+        self.path = path
+        self.journal_path = f"{path}.journal"
+        self.binary_path = f"{path}.msgpack" if STORE_BINARY_SNAPSHOTS and msgpack else None
+        self.needs_compaction = False # Set when the binary snapshot is missing or stale
+
+    def _binary_is_current(self):
+        if not self.binary_path or not os.path.exists(self.binary_path): return False
+        return not os.path.exists(self.path) or os.stat(self.binary_path).st_mtime_ns >= os.stat(self.path).st_mtime_ns
+
+    def load(self, apply):
+        data = None
+        if self._binary_is_current():
+            try:
+                with open(self.binary_path, 'rb') as f:
+                    data = msgpack.unpackb(f.read())
+            except Exception as e:
+                logger.error(f"Error loading binary snapshot {self.binary_path}, falling back to JSON: {e}")
+        self.needs_compaction = bool(self.binary_path) and data is None and os.path.exists(self.path)
+        if data is None:
+            data = self._load_json()
+        replayed = 0
+        if os.path.exists(self.journal_path):
+            with open(self.journal_path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        apply(data, json.loads(line))
+                        replayed += 1
+                    except ValueError:
+                        logger.warning(f"Skipping torn journal entry in {self.journal_path}")
+        return data, replayed
+
+    def _load_json(self):
+        data = {}
+        if os.path.exists(self.path):
             try:
-                async with aiofiles.open(path, 'r', encoding='utf-8') as f:
-                    return json.loads(await f.read())
+                with open(self.path, 'r', encoding='utf-8') as f:
+                    text = f.read()
+                data = json.loads(text) if text.strip() else {}
             except Exception as e:
-                logger.error(f"Error loading DB {path}: {e}")
-                return {}
-        return {}
-async def save_db(path, db):
-    async with db_lock:
+                logger.error(f"Error loading DB {self.path}: {e}")
+        return data
+
+    async def write(self, ops):
+        lines = [json.dumps(op) for op in ops]
+        async with aiofiles.open(self.journal_path, 'a', encoding='utf-8') as f:
+            await f.write("\n".join(lines) + "\n")
+
+    async def compact(self, snapshot):
+        await asyncio.to_thread(self._write_snapshot, snapshot)
+
+    def _write_snapshot(self, snapshot):
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(snapshot, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+        if self.binary_path: # Written second, so it is never newer than a JSON it doesn't match
+            with open(tmp_path, 'wb') as f:
+                f.write(msgpack.packb(snapshot))
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.binary_path)
+        self._rotate_journal()
+        self.needs_compaction = False
+
+    # A new, empty file rather than a truncation: the new inode tells search
+    # workers tailing the old one to start over from offset 0
+    def _rotate_journal(self):
+        tmp_path = f"{self.journal_path}.tmp"
+        open(tmp_path, 'w').close()
+        os.replace(tmp_path, self.journal_path)
+
+    def close(self):
+        pass
+
+class SqliteBackend:
+    snapshots = False
+
+    def __init__(self, name, path=DB_PATH_SQLITE, catalog=False):
+        self.name = name
+        self.path = path
+        self.table = f"kv_{name}"
+        self.catalog = catalog
+        self._db = None
+        self._reader = None          # Catalog searches: own connection on its own thread,
+        self._reader_executor = None # so they never wait on (or share) the writer's
+
+    def connect(self):
+        if self._db is None:
+            self._db = sqlite3.connect(self.path, check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("PRAGMA synchronous=NORMAL")
+            self._db.execute("PRAGMA busy_timeout=5000")
+            self._db.execute(f"CREATE TABLE IF NOT EXISTS {self.table} (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+            if self.catalog:
+                self._db.executescript("""
+                    CREATE VIRTUAL TABLE IF NOT EXISTS catalog_titles USING fts5(title, names, tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3');
+                    CREATE TABLE IF NOT EXISTS catalog_changes (seq INTEGER PRIMARY KEY AUTOINCREMENT, key TEXT NOT NULL);
+                """)
+            self._db.commit()
+        return self._db
+
+    def load(self, apply):
+        rows = self.connect().execute(f"SELECT key, value FROM {self.table}")
+        return {key: json.loads(value) for key, value in rows}, 0
+
+    async def write(self, ops):
+        await asyncio.to_thread(self.write_sync, ops)
+
+    def write_sync(self, ops):
+        db = self.connect()
+        with db: # One transaction per batch of ops
+            for op in ops:
+                if op[0] == "s":
+                    db.execute(f"INSERT INTO {self.table} (key, value) VALUES (?, ?) ON CONFLICT(key) DO UPDATE SET value = excluded.value", (op[1], json.dumps(op[2])))
+                    if self.catalog:
+                        self._index_group(db, op[1], op[2])
+                elif op[0] == "d":
+                    if self.catalog:
+                        self._unindex_group(db, op[1])
+                    db.execute(f"DELETE FROM {self.table} WHERE key = ?", (op[1],))
+                elif op[0] == "c":
+                    db.execute(f"DELETE FROM {self.table}")
+                    if self.catalog:
+                        db.execute("DELETE FROM catalog_titles")
+            if self.catalog:
+                # Changed keys, in order, for search worker replicas ("" = cleared)
+                db.executemany("INSERT INTO catalog_changes (key) VALUES (?)", [(op[1] if op[0] != "c" else "",) for op in ops])
+                db.execute("DELETE FROM catalog_changes WHERE seq <= (SELECT MAX(seq) FROM catalog_changes) - ?", (CATALOG_CHANGES_KEPT,))
+
+    # The FTS row shares the rowid of the group's kv row. Text is stored
+    # normalized (folded, tokenized) so queries match the way SearchIndex does.
+    def _index_group(self, db, group_id, group):
+        self._unindex_group(db, group_id)
+        rowid = db.execute(f"SELECT rowid FROM {self.table} WHERE key = ?", (group_id,)).fetchone()[0]
+        names = ' '.join(file.get("fileName", "") for qualities in group.get("languages", {}).values() for file in qualities.values())
+        db.execute("INSERT INTO catalog_titles (rowid, title, names) VALUES (?, ?, ?)",
+                   (rowid, normalize_query(group.get("groupName", "")), normalize_query(names)))
+
+    def _unindex_group(self, db, group_id):
+        row = db.execute(f"SELECT rowid FROM {self.table} WHERE key = ?", (group_id,)).fetchone()
+        if row:
+            db.execute("DELETE FROM catalog_titles WHERE rowid = ?", (row[0],))
+
+    # Same contract as SearchIndex.search: [(score, group_id)], best first. Every
+    # query word must start some word of the title or a file name; title matches
+    # weigh double. Sees what has been flushed, i.e. at most STORE_JOURNAL_INTERVAL old.
+    async def search_titles(self, query, limit=SEARCH_TOP_K):
+        if self._reader_executor is None:
+            self._reader_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="catalog-search")
+        return await asyncio.get_running_loop().run_in_executor(self._reader_executor, self._search_sync, query, limit)
+
+    def _search_sync(self, query, limit):
+        words = list(dict.fromkeys(tokenize(query)))
+        if not words: return []
+        if self._reader is None:
+            self.connect() # Creates the tables on a fresh database
+            self._reader = sqlite3.connect(self.path, check_same_thread=False)
+        match = ' '.join(f'"{word}"*' for word in words)
+        rows = self._reader.execute(
+            f"SELECT -bm25(catalog_titles, 2.0, 1.0), k.key FROM catalog_titles t JOIN {self.table} k ON k.rowid = t.rowid "
+            "WHERE catalog_titles MATCH ? ORDER BY bm25(catalog_titles, 2.0, 1.0) LIMIT ?",
+            (match, limit)
+        )
+        return [(score, key) for score, key in rows]
+
+    async def compact(self, snapshot):
+        pass
+
+    def close(self):
+        if self._reader_executor is not None:
+            self._reader_executor.shutdown(wait=True)
+            self._reader_executor = None
+        if self._reader is not None:
+            self._reader.close()
+            self._reader = None
+        if self._db is not None:
+            self._db.close()
+            self._db = None
+
+def make_backend(name, json_path, catalog=False):
+    if STORAGE_BACKEND == "sqlite":
+        return SqliteBackend(name, catalog=catalog)
+    return JsonBackend(name, json_path)
+
+class ResidentStore:
+    def __init__(self, backend):
+        self.backend = backend
+        self.name = backend.name
+        self.data = {}
+        self._pending = []
+        self._dirty = 0
+        self._last_snapshot = time.monotonic()
+        self.bulk_loading = False # Journal only, no early snapshots (bulk imports); caller snapshots at the end
+        self._wake = asyncio.Event()
+        self._io_lock = asyncio.Lock()
+        self._task = None
+        self._closing = False
+        self._watchers = []
+
+    def watch(self, callback):
+        # callback(op) runs after every in-memory change (not on load)
+        self._watchers.append(callback)
+
+    def load(self):
+        # Millions of new containers would otherwise trigger repeated full GC
+        # passes mid-parse, roughly doubling the load time of a large catalog
+        gc_enabled = gc.isenabled()
+        gc.disable()
         try:
-            async with aiofiles.open(path, 'w', encoding='utf-8') as f:
-                await f.write(json.dumps(db, indent=4))
-        except Exception as e:
-            logger.error(f"CRITICAL: Error saving DB {path}: {e}")
+            with metrics.timer("store_load_seconds", store=self.name):
+                self.data, replayed = self.backend.load(self._apply_to)
+        finally:
+            if gc_enabled: gc.enable()
+        self._dirty = replayed
+        if self.backend.snapshots and self.backend.needs_compaction:
+            self._wake.set() # First flush writes the missing binary snapshot
+        logger.info(f"Loaded {self.name} ({type(self.backend).__name__}): {len(self.data)} keys ({replayed} journal entries replayed)")
+
+    @staticmethod
+    def _apply_to(data, op):
+        if op[0] == "s":
+            data[op[1]] = op[2]
+        elif op[0] == "d":
+            data.pop(op[1], None)
+        elif op[0] == "c":
+            data.clear()
+
+    def _record(self, op):
+        # Queued for the journal before any watcher runs: memory and disk stay in
+        # step even if a derived index chokes on the value
+        self._apply_to(self.data, op)
+        self._pending.append(op)
+        self._dirty += 1
+        if self._dirty >= STORE_DIRTY_THRESHOLD:
+            self._wake.set()
+        for callback in self._watchers:
+            try:
+                callback(op)
+            except Exception:
+                logger.exception(f"Store {self.name}: change hook {getattr(callback, '__qualname__', callback)} failed")
+
+    # --- Reads (memory only) ---
+    def get(self, key, default=None):
+        return self.data.get(key, default)
+
+    def __contains__(self, key):
+        return key in self.data
+
+    def __len__(self):
+        return len(self.data)
+
+    def items(self):
+        return self.data.items()
+
+    def values(self):
+        return self.data.values()
+
+    # --- Writes ---
+    def set(self, key, value):
+        self._record(["s", key, value])
+
+    def delete(self, key):
+        if key in self.data:
+            self._record(["d", key])
+
+    def clear(self):
+        self._record(["c"])
+
+    # --- Persistence ---
+    def start(self):
+        if not self._task:
+            self._task = asyncio.create_task(self._run())
+
+    async def _run(self):
+        while not self._closing:
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout=STORE_JOURNAL_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+            if self._closing: break
+            self._wake.clear()
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error(f"CRITICAL: Error persisting DB {self.name}: {e}")
+
+    async def flush(self, force_snapshot=False):
+        waited_from = time.perf_counter()
+        async with self._io_lock:
+            started = time.perf_counter()
+            metrics.observe("store_lock_wait_seconds", started - waited_from, store=self.name)
+            try:
+                await self._flush_locked(force_snapshot)
+            finally:
+                metrics.observe("store_flush_seconds", time.perf_counter() - started, store=self.name)
+
+    async def _flush_locked(self, force_snapshot):
+        if self._pending:
+            ops, self._pending = self._pending, []
+            try:
+                await self.backend.write(ops)
+            except BaseException: # Cancelled included: the ops are off _pending already
+                self._pending[:0] = ops
+                raise
+
+        if not self.backend.snapshots:
+            self._dirty = 0
+            return
+        overdue = time.monotonic() - self._last_snapshot >= STORE_SNAPSHOT_INTERVAL
+        due = force_snapshot or not self.bulk_loading and (overdue or self._dirty >= STORE_DIRTY_THRESHOLD)
+        if (self._dirty and due) or self.backend.needs_compaction:
+            await self._compact()
+
+    async def _compact(self):
+        # Everything up to here is in the journal; anything set() from now on
+        # stays in _pending until the snapshot has replaced the journal.
+        snapshot = dict(self.data)
+        dirty, self._dirty = self._dirty, 0
+        try:
+            await self.backend.compact(snapshot)
+        except Exception:
+            self._dirty += dirty
+            raise
+        self._last_snapshot = time.monotonic()
+
+    async def close(self):
+        # The loop is stopped, not cancelled: a write it has handed to the
+        # backend thread finishes before the final flush and backend.close()
+        if self._task:
+            self._closing = True
+            self._wake.set()
+            await self._task
+            self._task = None
+        await self.flush(force_snapshot=True)
+        self.backend.close()
+
+STORE_PATHS = {
+    "files": DB_PATH_FILES,
+    "requests": DB_PATH_REQUESTS,
+    "popularity": DB_PATH_POPULARITY,
+    "scrape_jobs": DB_PATH_SCRAPE_JOBS,   # /index checkpoints, keyed by channel
+    "broadcasts": DB_PATH_BROADCASTS,     # /broadcast delivery state, keyed by title
+    "meta": DB_PATH_META
+}
+files_store = ResidentStore(make_backend("files", DB_PATH_FILES, catalog=True))
+requests_store = ResidentStore(make_backend("requests", DB_PATH_REQUESTS))
+popularity_store = ResidentStore(make_backend("popularity", DB_PATH_POPULARITY))
+scrape_jobs_store = ResidentStore(make_backend("scrape_jobs", DB_PATH_SCRAPE_JOBS))
+broadcasts_store = ResidentStore(make_backend("broadcasts", DB_PATH_BROADCASTS))
+meta_store = ResidentStore(make_backend("meta", DB_PATH_META))
+ALL_STORES = (files_store, requests_store, popularity_store, scrape_jobs_store, broadcasts_store, meta_store)
+
+# `python bot.py migrate-sqlite`: copies every JSON database (snapshot + journal)
+# into DB_PATH_SQLITE, replacing what is there. Safe to re-run.
+def migrate_json_to_sqlite():
+    for name, path in STORE_PATHS.items():
+        data, replayed = JsonBackend(name, path).load(ResidentStore._apply_to)
+        backend = SqliteBackend(name, catalog=(name == "files"))
+        backend.write_sync([["c"]] + [["s", key, value] for key, value in data.items()])
+        backend.close()
+        logger.info(f"Migrated {name}: {len(data)} keys from {path} into {DB_PATH_SQLITE}")
+
+# --- Normalization (shared by indexing, search, callbacks and popularity) ---
+# Text is NFKC-normalized and case-folded, Latin accents are stripped ("Amélie"
+# -> "amelie"), and anything that isn't a letter or digit in any script splits
+# words. Group IDs are the words joined by "-", so every spelling of a title
+# maps to one key.
+# Indic vowel signs are combining marks, which \w leaves out, so those blocks
+# (minus the danda punctuation) are listed explicitly.
+TOKEN_RE = re.compile(r'(?:[^\W_]|[\u0900-\u0963\u0966-\u0dff])+')
+LATIN_FOLD_TABLE = {
+    code: ''.join(c for c in unicodedata.normalize('NFKD', chr(code)) if not unicodedata.combining(c))
+    for code in range(0xC0, 0x250)
+}
+
+def fold_text(text):
+    text = unicodedata.normalize('NFKC', text).casefold()
+    return text if text.isascii() else text.translate(LATIN_FOLD_TABLE)
+
+def tokenize(text):
+    return TOKEN_RE.findall(fold_text(text))
+
+def normalize_query(text):
+    return ' '.join(tokenize(text))
+
+def make_group_id(group_name):
+    return '-'.join(tokenize(group_name)) or "untitled"
+
+def popularity_key(group_name, lang, quality):
+    return f"{make_group_id(group_name)}_{make_group_id(lang)}_{make_group_id(quality)}"
+
+# One-shot, idempotent clean-up of keys written by older versions, where the
+# "regex" replace was a literal no-op: groups whose names normalize to the same
+# ID are merged (files already under the canonical key win a slot), searchAll
+# is reset to the bare title, and popularity counters are re-keyed and summed.
+# Skipped once meta_store records CATALOG_VERSION, since it scans everything.
+CATALOG_VERSION = 1
+
+def migrate_catalog():
+    if meta_store.get("catalogVersion") == CATALOG_VERSION: return
+    buckets = {}
+    for group_id, group in files_store.items():
+        buckets.setdefault(make_group_id(group["groupName"]), []).append((group_id, group))
+
+    merged_groups = 0
+    for new_id, entries in buckets.items():
+        entries.sort(key=lambda entry: entry[0] != new_id) # Canonical key first
+        primary_id, primary = entries[0]
+        search_all = normalize_query(primary["groupName"])
+        if len(entries) == 1 and primary_id == new_id and primary.get("searchAll") == search_all:
+            continue
+
+        group = copy.deepcopy(primary)
+        group["searchAll"] = search_all
+        for old_id, other in entries[1:]:
+            for lang, qualities in other.get("languages", {}).items():
+                for quality, file in qualities.items():
+                    group["languages"].setdefault(lang, {}).setdefault(quality, file)
+        for old_id, other in entries:
+            if old_id != new_id:
+                files_store.delete(old_id)
+                merged_groups += 1
+        files_store.set(new_id, group)
+
+    counters = {}
+    for item in popularity_store.values():
+        key = popularity_key(item["groupName"], item["lang"], item["quality"])
+        if key in counters:
+            counters[key] = {**counters[key], "count": counters[key]["count"] + item["count"]}
+        else:
+            counters[key] = item
+    rekeyed = [key for key in popularity_store.data if key not in counters]
+    for key in rekeyed:
+        popularity_store.delete(key)
+    for key, item in counters.items():
+        if popularity_store.get(key) != item:
+            popularity_store.set(key, item)
+
+    if merged_groups or rekeyed:
+        logger.info(f"Migration: re-keyed {merged_groups} groups and {len(rekeyed)} popularity entries")
+    meta_store.set("catalogVersion", CATALOG_VERSION)
 
 # --- 3. GEMINI AI HELPER ---
-async def call_gemini(session, prompt, schema=None, use_search=False):
+
+# --- 3a. Shared HTTP Client ---
+# One pooled session for the life of the bot, so AI calls reuse warm TCP/TLS
+# connections instead of handshaking with Google every time. Created on first
+# use (it needs a running loop) and closed on shutdown.
+class HttpClient:
+    def __init__(self):
+        self.timeout = aiohttp.ClientTimeout(total=None, connect=HTTP_CONNECT_TIMEOUT, sock_read=HTTP_READ_TIMEOUT)
+        self.retries = HTTP_RETRIES
+        self.backoff = HTTP_BACKOFF
+        self._session = None
+
+    @property
+    def session(self):
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=HTTP_POOL_SIZE,
+                limit_per_host=HTTP_POOL_PER_HOST,
+                ttl_dns_cache=HTTP_DNS_CACHE_TTL
+            )
+            self._session = aiohttp.ClientSession(connector=connector, timeout=self.timeout)
+        return self._session
+
+    def backoff_delay(self, attempt):
+        return self.backoff * (2 ** attempt)
+
+    async def close(self):
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+
+http_client = HttpClient()
+
+# --- 3b. Response Cache ---
+# Content-addressed on (prompt, schema, use_search). A bounded in-memory LRU sits
+# in front of a sqlite table; failures (None) are cached in memory only, for
+# GEMINI_NEGATIVE_TTL, so repeated bad queries can't stampede the API.
+# Concurrent identical calls share a single in-flight request.
+class GeminiCache:
+    def __init__(self, path, max_entries=GEMINI_CACHE_MAX_ENTRIES):
+        self.path = path
+        self.max_entries = max_entries
+        self.entries = OrderedDict() # key -> (expires_at, value)
+        self.inflight = {}
+        self.stats = {"hits": 0, "diskHits": 0, "negativeHits": 0, "coalesced": 0, "misses": 0}
+        self._db = None
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="gemini-cache")
+
+    @staticmethod
+    def make_key(prompt, schema, use_search):
+        raw = json.dumps([prompt, schema, use_search], sort_keys=True)
+        return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+    # --- sqlite tier (runs on the single cache thread) ---
+    def _disk_get(self, key, now):
+        if self._db is None:
+            self._db = sqlite3.connect(self.path, check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("CREATE TABLE IF NOT EXISTS gemini_cache (key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL)")
+            self._db.execute("DELETE FROM gemini_cache WHERE expires_at <= ?", (now,))
+            self._db.commit()
+        row = self._db.execute("SELECT value, expires_at FROM gemini_cache WHERE key = ? AND expires_at > ?", (key, now)).fetchone()
+        return (row[1], json.loads(row[0])) if row else None
+
+    def _disk_put(self, key, value, expires_at):
+        self._db.execute("INSERT OR REPLACE INTO gemini_cache (key, value, expires_at) VALUES (?, ?, ?)", (key, json.dumps(value), expires_at))
+        self._db.commit()
+
+    def _remember(self, key, expires_at, value):
+        self.entries[key] = (expires_at, value)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    async def get(self, key):
+        # Returns (found, value); a cached failure is (True, None)
+        now = time.time()
+        entry = self.entries.get(key)
+        if entry and entry[0] > now:
+            self.entries.move_to_end(key)
+            self.stats["hits" if entry[1] is not None else "negativeHits"] += 1
+            return True, entry[1]
+
+        row = await asyncio.get_running_loop().run_in_executor(self._executor, self._disk_get, key, now)
+        if row:
+            self.stats["diskHits"] += 1
+            self._remember(key, *row)
+            return True, row[1]
+        self.stats["misses"] += 1
+        return False, None
+
+    async def put(self, key, value, ttl):
+        if value is None:
+            expires_at = time.time() + GEMINI_NEGATIVE_TTL
+        else:
+            expires_at = time.time() + ttl
+            await asyncio.get_running_loop().run_in_executor(self._executor, self._disk_put, key, value, expires_at)
+        self._remember(key, expires_at, value)
+
+    # valid(value): answers failing it are never served or stored as hits
+    async def fetch(self, key, ttl, factory, valid=None):
+        if key in self.inflight:
+            self.stats["coalesced"] += 1
+            return await asyncio.shield(self.inflight[key])
+
+        future = asyncio.get_running_loop().create_future()
+        self.inflight[key] = future
+        try:
+            found, value = await self.get(key)
+            if found and value is not None and valid and not valid(value):
+                found = False
+            if not found:
+                value = await factory()
+                if value is not None and valid and not valid(value):
+                    value = None # Cached as a failure, so it is retried after GEMINI_NEGATIVE_TTL
+                await self.put(key, value, ttl)
+            future.set_result(value)
+            return value
+        finally:
+            if not future.done():
+                future.set_result(None) # Waiters see a failed call, not our exception
+            del self.inflight[key]
+
+    async def close(self):
+        def _close():
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+        await asyncio.get_running_loop().run_in_executor(self._executor, _close)
+        self._executor.shutdown(wait=False)
+
+gemini_cache = GeminiCache(DB_PATH_AI_CACHE)
+
+async def call_gemini(prompt, schema=None, use_search=False, valid=None):
+    kind = "search" if use_search else ("structured" if schema else "text")
+    key = GeminiCache.make_key(prompt, schema, use_search)
+    return await gemini_cache.fetch(key, GEMINI_CACHE_TTL[kind], lambda: call_gemini_uncached(prompt, schema, use_search), valid)
+
+async def call_gemini_uncached(prompt, schema=None, use_search=False):
     payload = {
         "contents": [{"parts": [{"text": prompt}]}],
         "systemInstruction": {"parts": [{"text": "You are a helpful assistant."}]}
@@ -118,110 +954,958 @@ async def call_gemini(session, prompt, schema=None, use_search=False):
     if use_search:
         payload["tools"] = [{"google_search": {}}]
 
-    delay = 1000
-    for i in range(3): # Retry up to 3 times
+    for i in range(http_client.retries):
+        started = time.perf_counter()
+        status = "error" # Network error or timeout unless we get further
         try:
-            async with session.post(url, json=payload, timeout=60) as response:
+            async with http_client.session.post(url, json=payload) as response:
                 if response.status != 200:
+                    status = f"http_{response.status}"
                     raise Exception(f"API call failed with status {response.status}")
                 
+                status = "invalid"
                 result = await response.json()
                 text = result.get("candidates", [{}])[0].get("content", {}).get("parts", [{}])[0].get("text")
                 
                 if not text:
                     raise Exception("Invalid AI response structure.")
                 
-                if schema:
-                    return json.loads(text) # Return JSON object
-                else:
-                    return text # Return plain text
+                answer = json.loads(text) if schema else text # JSON object or plain text
+                metrics.observe("gemini_request_seconds", time.perf_counter() - started, status="ok")
+                return answer
         
         except Exception as e:
+            metrics.observe("gemini_request_seconds", time.perf_counter() - started, status=status)
             logger.error(f"Gemini call attempt {i + 1} failed: {e}")
-            if i < 2:
-                await asyncio.sleep(delay / 1000.0)
-                delay *= 2 # Exponential backoff
+            if i < http_client.retries - 1:
+                await asyncio.sleep(http_client.backoff_delay(i)) # Exponential backoff
             else:
                 return None # Failed all retries
 
 # --- 4. POPULARITY TRACKER ---
+# Clicks are counted in memory and written to popularity_store as deltas every
+# POPULARITY_FLUSH_INTERVAL seconds (and on shutdown). Besides the all-time
+# "count", each entry keeps sparse time buckets in "recent" ({bucket_start:
+# clicks}, only as far back as the longest window). Rolling totals per window are
+# maintained incrementally, so "trending" never rescans the history.
+class PopularityTracker:
+    def __init__(self):
+        self.pending = {}   # key -> {"groupName", "lang", "quality", "count", "recent"} not yet flushed
+        self.buckets = OrderedDict() # bucket_start -> {key: clicks}, oldest first
+        self.meta = {}      # key -> (groupName, lang, quality)
+        self.totals = {name: {} for name in POPULARITY_WINDOWS}
+        self.window_start = {name: 0 for name in POPULARITY_WINDOWS}
+        self._task = None
+
+    @staticmethod
+    def bucket_of(now):
+        return int(now // POPULARITY_BUCKET_SECONDS) * POPULARITY_BUCKET_SECONDS
+
+    # Rebuilds only the window state; unflushed clicks and the flush task are kept
+    def load(self):
+        self.buckets = OrderedDict()
+        self.meta = {}
+        self.totals = {name: {} for name in POPULARITY_WINDOWS}
+        self.window_start = {name: 0 for name in POPULARITY_WINDOWS}
+        horizon = self.bucket_of(time.time()) - max(POPULARITY_WINDOWS.values())
+        restored = {}
+        for key, item in popularity_store.items():
+            self.meta[key] = (item["groupName"], item["lang"], item["quality"])
+            for bucket, clicks in item.get("recent", {}).items():
+                if int(bucket) > horizon:
+                    restored.setdefault(int(bucket), {})[key] = clicks
+        for bucket in sorted(restored):
+            self.buckets[bucket] = restored[bucket]
+        self._advance(time.time(), rebuild=True)
+
+    def _advance(self, now, rebuild=False):
+        current = self.bucket_of(now)
+        for name, length in POPULARITY_WINDOWS.items():
+            start = current - length + POPULARITY_BUCKET_SECONDS
+            totals = self.totals[name]
+            for bucket, counts in self.buckets.items():
+                in_window = bucket >= start
+                if rebuild and in_window:
+                    for key, clicks in counts.items():
+                        totals[key] = totals.get(key, 0) + clicks
+                elif not rebuild and self.window_start[name] <= bucket < start:
+                    for key, clicks in counts.items(): # Bucket just fell out of this window
+                        left = totals.get(key, 0) - clicks
+                        if left > 0: totals[key] = left
+                        else: totals.pop(key, None)
+                elif in_window:
+                    break
+            self.window_start[name] = start
+
+        oldest = min(self.window_start.values())
+        while self.buckets and next(iter(self.buckets)) < oldest:
+            self.buckets.popitem(last=False)
+
+    def record(self, group_name, lang, quality, now=None):
+        now = now or time.time()
+        if self.bucket_of(now) not in self.buckets:
+            self._advance(now)
+        bucket = self.bucket_of(now)
+        key = popularity_key(group_name, lang, quality)
+        self.meta[key] = (group_name, lang, quality)
+
+        counts = self.buckets.setdefault(bucket, {})
+        counts[key] = counts.get(key, 0) + 1
+        for totals in self.totals.values():
+            totals[key] = totals.get(key, 0) + 1
+
+        delta = self.pending.setdefault(key, {"groupName": group_name, "lang": lang, "quality": quality, "count": 0, "recent": {}})
+        delta["count"] += 1
+        delta["recent"][str(bucket)] = delta["recent"].get(str(bucket), 0) + 1
+
+    # Read-only; windows slide in record() and _run()
+    def trending(self, window, limit=20):
+        top = heapq.nlargest(limit, list(self.totals[window].items()), key=lambda item: item[1])
+        return [{"groupName": self.meta[key][0], "lang": self.meta[key][1], "quality": self.meta[key][2], "count": count} for key, count in top]
+
+    def flush(self):
+        if not self.pending: return
+        pending, self.pending = self.pending, {}
+        horizon = self.bucket_of(time.time()) - max(POPULARITY_WINDOWS.values())
+        for key, delta in pending.items():
+            entry = popularity_store.get(key) or {"groupName": delta["groupName"], "lang": delta["lang"], "quality": delta["quality"], "count": 0}
+            recent = {bucket: clicks for bucket, clicks in entry.get("recent", {}).items() if int(bucket) > horizon}
+            for bucket, clicks in delta["recent"].items():
+                recent[bucket] = recent.get(bucket, 0) + clicks
+            popularity_store.set(key, {**entry, "count": entry["count"] + delta["count"], "recent": recent})
+        logger.info(f"Popularity: flushed clicks for {len(pending)} files")
+
+    def start(self):
+        if not self._task:
+            self._task = asyncio.create_task(self._run())
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(POPULARITY_FLUSH_INTERVAL)
+            try:
+                self._advance(time.time())
+                self.flush()
+            except Exception as e:
+                logger.error(f"Error flushing popularity counters: {e}")
+
+    def close(self):
+        if self._task:
+            self._task.cancel()
+            self._task = None
+        self.flush()
+
+popularity_tracker = PopularityTracker()
+
 async def track_popularity(file_data):
     try:
-        group_name = file_data.get("groupName")
-        lang = file_data.get("lang")
-        quality = file_data.get("quality")
-        
-        db_key = f"{group_name}_{lang}_{quality}".lower().replace(r'[^a-z0-9_]', '').replace('__', '_')
-        
-        db = await load_db(DB_PATH_POPULARITY)
-        
-        if db_key not in db:
-            db[db_key] = {"groupName": group_name, "lang": lang, "quality": quality, "count": 0}
-        
-        db[db_key]["count"] += 1
-        await save_db(DB_PATH_POPULARITY, db)
-        logger.info(f"Popularity +1 for: {group_name} ({lang} / {quality})")
-    
+        popularity_tracker.record(file_data.get("groupName"), file_data.get("lang"), file_data.get("quality"))
     except Exception as e:
         logger.error(f"Error tracking popularity: {e}")
 
+# --- 4a. REQUEST REGISTRY ---
+# Requesters are kept in memory as a set of user IDs per normalized title (see
+# request_key), with the number of requesters and a lazily pruned max-heap for
+# the top list. requests_store holds one small "<title key>\t<user id>" entry
+# per request, so adding a requester journals a single op however popular the
+# title is. The display title is the spelling the first requester used.
+class RequestRegistry:
+    def __init__(self):
+        self.requesters = {} # title key -> set of user IDs
+        self.titles = {}     # title key -> display title
+        self._heap = []      # (-count, title key); stale entries are skipped
+
+    @staticmethod
+    def request_key(title):
+        words = [word for word in tokenize(title) if word not in REQUEST_FILLER_WORDS]
+        return ' '.join(words) or normalize_query(title)
+
+    @staticmethod
+    def entry_key(key, user_id):
+        return f"{key}\t{user_id}"
+
+    def load(self):
+        self.__init__()
+        legacy = []
+        for entry, title in list(requests_store.items()):
+            if isinstance(title, list): # Older format: title -> [user IDs]
+                legacy.append((entry, title))
+                continue
+            key, user_id = entry.rsplit('\t', 1)
+            self._add_to_memory(key, int(user_id), title)
+        for title, user_ids in legacy:
+            requests_store.delete(title)
+            for user_id in user_ids:
+                self.add(title, user_id)
+        for key in self.requesters:
+            self._push(key)
+        if legacy:
+            logger.info(f"Requests: migrated {len(legacy)} titles to per-user entries")
+
+    def _add_to_memory(self, key, user_id, title):
+        users = self.requesters.get(key)
+        if users is None:
+            users = self.requesters[key] = set()
+            self.titles[key] = title
+        if user_id in users:
+            return False
+        users.add(user_id)
+        return True
+
+    def _push(self, key):
+        heapq.heappush(self._heap, (-len(self.requesters[key]), key))
+        if len(self._heap) > 2 * len(self.requesters) + 64:
+            self._heap = [(-len(users), key) for key, users in self.requesters.items()]
+            heapq.heapify(self._heap)
+
+    def add(self, title, user_id):
+        key = self.request_key(title)
+        if not self._add_to_memory(key, user_id, title):
+            return False
+        requests_store.set(self.entry_key(key, user_id), self.titles[key])
+        self._push(key)
+        return True
+
+    def find(self, title):
+        key = self.request_key(title)
+        return (self.titles[key], self.requesters[key]) if key in self.requesters else (None, set())
+
+    def remove(self, title):
+        key = self.request_key(title)
+        for user_id in self.requesters.pop(key, ()):
+            requests_store.delete(self.entry_key(key, user_id))
+        self.titles.pop(key, None)
+
+    def clear(self):
+        self.__init__()
+        requests_store.clear()
+
+    def top(self, limit=20):
+        # Pops until `limit` current entries are found, then pushes them back
+        found, seen = [], set()
+        while self._heap and len(found) < limit:
+            count, key = heapq.heappop(self._heap)
+            if key in seen or key not in self.requesters or -count != len(self.requesters[key]):
+                continue
+            seen.add(key)
+            found.append((count, key))
+        for item in found:
+            heapq.heappush(self._heap, item)
+        return [(self.titles[key], -count) for count, key in found]
+
+    def __len__(self):
+        return len(self.requesters)
+
+request_registry = RequestRegistry()
+
 # --- 5. CENTRALIZED AI-POWERED INDEXER ---
-async def process_file_for_indexing(file_message: Message):
-    if not file_message or not (file_message.document or file_message.video):
-        return {"status": "failure", "error": "No file object"}
-    
-    file = file_message.document or file_message.video
-    file_name = file.file_name if file.file_name else "Untitled"
-    
-    prompt = f'Analyze: "{file_name}". Extract: "groupName" (canonical title), "lang" (full language name or "Unknown"), "quality" (e.g., "720p" or "SD").'
-    schema = {
-        "type": "OBJECT",
-        "properties": {
-            "groupName": {"type": "STRING"},
-            "lang": {"type": "STRING"},
-            "quality": {"type": "STRING"}
-        },
-        "required": ["groupName", "lang", "quality"]
-    }
-    
-    try:
-        async with aiohttp.ClientSession() as session:
-            ai_response = await call_gemini(session, prompt, schema, False)
+FILE_INFO_SCHEMA = {
+    "type": "OBJECT",
+    "properties": {
+        "groupName": {"type": "STRING"},
+        "lang": {"type": "STRING"},
+        "quality": {"type": "STRING"}
+    },
+    "required": ["groupName", "lang", "quality"]
+}
+FILE_INFO_FIELDS = '"groupName" (canonical title), "lang" (full language name or "Unknown"), "quality" (e.g., "720p" or "SD")'
+
+def file_info_prompt(file_name):
+    return f'Analyze: "{file_name}". Extract: {FILE_INFO_FIELDS}.'
+
+def is_valid_file_info(info):
+    return isinstance(info, dict) and all(isinstance(info.get(field), str) and info[field] for field in FILE_INFO_SCHEMA["required"])
+
+# Returns one AI answer (or None) per file name. Scene-style names are handled by
+# the local parser; names seen before come from the Gemini cache; the rest are
+# classified together in a single structured-output request, and each answer is
+# cached under its single-file key.
+async def classify_file_names(file_names):
+    results = [None] * len(file_names)
+    keys = [GeminiCache.make_key(file_info_prompt(name), FILE_INFO_SCHEMA, False) for name in file_names]
+    missing = []
+    for i, key in enumerate(keys):
+        parsed = parse_release_name(file_names[i])
+        if parsed["confidence"] >= PARSER_MIN_CONFIDENCE:
+            results[i] = {field: parsed[field] for field in FILE_INFO_SCHEMA["required"]}
+            continue
+        found, value = await gemini_cache.get(key)
+        if found and (value is None or is_valid_file_info(value)): # Older runs may have cached a bad answer
+            results[i] = value
+        else:
+            missing.append(i)
+
+    if len(missing) > 1:
+        listing = "\n".join(f'{n + 1}. "{file_names[i]}"' for n, i in enumerate(missing))
+        prompt = f'Analyze each of these {len(missing)} file names:\n{listing}\nFor each one, in the same order, extract: {FILE_INFO_FIELDS}.'
+        batch = await call_gemini_uncached(prompt, {"type": "ARRAY", "items": FILE_INFO_SCHEMA}, False)
+        if isinstance(batch, list) and len(batch) == len(missing):
+            for i, info in zip(missing, batch):
+                if is_valid_file_info(info):
+                    results[i] = info
+                    await gemini_cache.put(keys[i], info, GEMINI_CACHE_TTL["structured"])
+            missing = [i for i in missing if results[i] is None]
+        else:
+            logger.warning(f"Batch AI classification of {len(missing)} files returned a mismatched answer. Retrying one by one.")
+
+    # Single leftovers, and anything the batch answer didn't cover
+    answers = await asyncio.gather(*(call_gemini(file_info_prompt(file_names[i]), FILE_INFO_SCHEMA, False, is_valid_file_info) for i in missing))
+    for i, info in zip(missing, answers):
+        results[i] = info if is_valid_file_info(info) else None
+    return results
+
+# Applies classified files to the catalog. Files that land in the same group are
+# merged into one copy of it, so each group is written once per batch.
+def commit_indexed_files(file_messages, ai_responses):
+    results = []
+    groups = {}
+    for file_message, ai_response in zip(file_messages, ai_responses):
+        file = file_message.document or file_message.video
+        file_name = file.file_name if file.file_name else "Untitled"
 
         if not ai_response:
             logger.error(f"AI Indexing failed for: {file_name}")
-            return {"status": "failure", "error": "AI analysis failed", "fileName": file_name}
-        
+            results.append({"status": "failure", "error": "AI analysis failed", "fileName": file_name})
+            continue
+
         group_name = ai_response.get("groupName")
         lang = ai_response.get("lang")
         quality = ai_response.get("quality")
         file_id = file.file_id
         file_type = "video" if file_message.video else "document"
-        group_id = group_name.lower().replace(r'[^a-z0-9]', '_').replace('__', '_')
-        
-        db = await load_db(DB_PATH_FILES)
-        is_new_group = group_id not in db
-        
-        if is_new_group:
-            db[group_id] = {"groupName": group_name, "searchAll": f"{group_name.lower()}", "languages": {}}
-        
-        db[group_id]["searchAll"] += f" {file_name.lower().replace(r'[^a-z0-9]', ' ')}"
-        if lang not in db[group_id]["languages"]:
-            db[group_id]["languages"][lang] = {}
-        
-        db[group_id]["languages"][lang][quality] = {
+        group_id = make_group_id(group_name)
+
+        is_new_group = group_id not in files_store and group_id not in groups
+        group = groups.get(group_id)
+        if group is None:
+            if is_new_group:
+                group = {"groupName": group_name, "searchAll": normalize_query(group_name), "languages": {}}
+            else:
+                group = copy.deepcopy(files_store.get(group_id))
+            groups[group_id] = group
+
+        if lang not in group["languages"]:
+            group["languages"][lang] = {}
+
+        new_file = {
             "fileId": file_id,
             "fileName": file_name,
-            "fileType": file_type
+            "fileType": file_type,
+            "fileUniqueId": file.file_unique_id,
+            "fileSize": file.file_size or 0,
+            "postedAt": int(file_message.date.timestamp()) if file_message.date else 0
         }
-        
-        await save_db(DB_PATH_FILES, db)
-        
-        return {"status": "success", "groupName": group_name, "lang": lang, "quality": quality, "isNewGroup": is_new_group, "groupId": group_id}
+        current = group["languages"][lang].get(quality)
+        if current and not replaces_file(current, new_file):
+            results.append({"status": "duplicate", "groupName": group_name, "lang": lang, "quality": quality, "fileName": file_name, "groupId": group_id})
+            continue
+        group["languages"][lang][quality] = new_file
+
+        results.append({"status": "success", "groupName": group_name, "lang": lang, "quality": quality, "isNewGroup": is_new_group, "groupId": group_id})
+
+    for group_id, group in groups.items():
+        if group_id not in files_store or files_store.get(group_id) != group: # Nothing to write for pure duplicates
+            files_store.set(group_id, group)
+    return results
+
+# Whether new_file should take a group/lang/quality slot that current holds
+def replaces_file(current, new_file):
+    if same_file(current, new_file):
+        return False
+    if DUPLICATE_POLICY == "keep_largest":
+        return new_file["fileSize"] > current.get("fileSize", 0)
+    return new_file["postedAt"] >= current.get("postedAt", 0) # keep_newest, by post date: /index pages history newest first
+
+def same_file(a, b):
+    if a["fileId"] == b["fileId"] or a.get("fileUniqueId") and a.get("fileUniqueId") == b.get("fileUniqueId"):
+        return True
+    fingerprint = file_fingerprint(a.get("fileSize"), a.get("fileName"))
+    return fingerprint is not None and fingerprint == file_fingerprint(b.get("fileSize"), b.get("fileName"))
+
+# Secondary identity for copies that lost their file_unique_id (older catalog
+# entries, imports): same byte size and the same name once normalized
+def file_fingerprint(file_size, file_name):
+    if not file_size or not file_name: return None
+    return file_size, normalize_query(file_name)
+
+def is_file_message(file_message):
+    return bool(file_message and (file_message.document or file_message.video))
+
+# One AI answer (or None) per message; safe to run concurrently with other batches
+async def classify_file_messages(file_messages):
+    ai_responses = [None] * len(file_messages)
+    pending = []
+    for i, file_message in enumerate(file_messages):
+        if not is_file_message(file_message): continue
+        # Re-posts, forwards and re-scans reuse the slot the file already has
+        slot = file_id_index.lookup(file_message.document or file_message.video)
+        if slot:
+            group_id, lang, quality = slot
+            ai_responses[i] = {"groupName": files_store.get(group_id)["groupName"], "lang": lang, "quality": quality}
+        else:
+            pending.append(i)
+    if not pending:
+        return ai_responses
 
+    file_names = [(file_messages[i].document or file_messages[i].video).file_name or "Untitled" for i in pending]
+    try:
+        answers = await classify_file_names(file_names)
+    except Exception as e:
+        logger.error(f"AI Indexing failed for a batch of {len(pending)} files: {e}")
+        answers = [None] * len(pending)
+
+    for i, answer in zip(pending, answers):
+        ai_responses[i] = answer
+    return ai_responses
+
+def apply_indexed_files(file_messages, ai_responses):
+    results = [None] * len(file_messages)
+    pending = []
+    for i, file_message in enumerate(file_messages):
+        if not is_file_message(file_message):
+            results[i] = {"status": "failure", "error": "No file object"}
+        else:
+            pending.append(i)
+    if not pending:
+        return results
+
+    messages = [file_messages[i] for i in pending]
+    try:
+        committed = commit_indexed_files(messages, [ai_responses[i] for i in pending])
     except Exception as e:
-        logger.error(f'Error saving AI-indexed file to DB: {e}')
-        return {"status": "failure", "error": "Database save error", "fileName": file_name}
+        logger.error(f'Error saving AI-indexed files to DB: {e}')
+        committed = [{"status": "failure", "error": "Database save error", "fileName": (m.document or m.video).file_name or "Untitled"} for m in messages]
+
+    for i, result in zip(pending, committed):
+        results[i] = result
+    return results
+
+async def process_files_for_indexing(file_messages):
+    return apply_indexed_files(file_messages, await classify_file_messages(file_messages))
+
+async def process_file_for_indexing(file_message: Message):
+    return (await process_files_for_indexing([file_message]))[0]
+# --- 5a. RELEASE NAME PARSER ---
+# Deterministic parser for scene-style names like "Jawan.2023.Hindi.1080p.WEB-DL.x264-GRP.mkv".
+# The title is everything before the first release tag (year, resolution, source,
+# codec, language, SxxEyy); the score says how much of the name was understood.
+RELEASE_EXTENSION_RE = re.compile(r'\.(mkv|mp4|avi|m4v|mov|wmv|flv|webm|ts|zip|rar|7z)$', re.IGNORECASE)
+RELEASE_NOISE_RE = re.compile(r'^\s*(?:\[[^\]]*\]|\([^)]*\)|@\w+|www\.\S+?\.\w+)[\s._-]*')
+RELEASE_SPLIT_RE = re.compile(r'[\s._\[\]()+]+')
+RELEASE_YEAR_RE = re.compile(r'^(19[2-9]\d|20\d\d)$')
+RELEASE_RESOLUTION_RE = re.compile(r'^(?:(2160|1440|1080|720|576|480|360)[pi]|(4k|2k|uhd))$')
+RELEASE_EPISODE_RE = re.compile(r'^s(\d{1,2})(?:e(\d{1,3}))?$')
+RELEASE_SOURCES = {
+    'web-dl', 'webdl', 'webrip', 'web', 'bluray', 'blu-ray', 'brrip', 'bdrip', 'hdrip', 'dvdrip',
+    'dvdscr', 'hdtv', 'camrip', 'cam', 'hdcam', 'predvd', 'hdts', 'hdtc', 'amzn', 'nf', 'hotstar', 'zee5'
+}
+RELEASE_CODECS = {'x264', 'x265', 'h264', 'h265', 'hevc', 'avc', '10bit', 'aac', 'dd5', 'ddp5', 'esub', 'esubs', 'hdr'}
+RELEASE_LANGUAGES = {**LANGUAGE_MAP, 'hin': 'Hindi', 'tam': 'Tamil', 'tel': 'Telugu', 'mal': 'Malayalam', 'kan': 'Kannada', 'ben': 'Bengali', 'pun': 'Punjabi', 'mar': 'Marathi'}
+RELEASE_MULTI_LANGUAGE = {'dual', 'multi'}
+# Uploader filler between the title and the tags ("Jawan Full Movie Hindi 720p")
+RELEASE_FILLER_WORDS = {'full', 'movie', 'movies', 'film', 'hd', 'fullhd', 'hq', 'download', 'watch', 'online'}
+RELEASE_RESOLUTION_NAMES = {'2160': '4K', '4k': '4K', 'uhd': '4K', '1440': '2K', '2k': '2K'}
+
+def parse_release_name(file_name):
+    name = RELEASE_EXTENSION_RE.sub('', file_name.strip())
+    while True:
+        stripped = RELEASE_NOISE_RE.sub('', name, count=1)
+        if stripped == name: break
+        name = stripped
+
+    parsed = {"groupName": None, "lang": None, "quality": None, "year": None, "season": None,
+              "episode": None, "source": None, "codec": None, "releaseGroup": None, "confidence": 0.0}
+    languages = []
+    tokens = [token for token in RELEASE_SPLIT_RE.split(name) if token]
+    # Only a year, a resolution or SxxEyy opens the tag region; source, codec and
+    # language words are only tags from there on ("The.Web.2023" is titled "The Web")
+    anchor = next((i for i, token in enumerate(tokens)
+                   if RELEASE_YEAR_RE.match(token.lower()) and i or RELEASE_RESOLUTION_RE.match(token.lower()) or RELEASE_EPISODE_RE.match(token.lower())), None)
+    tags_started = anchor is not None
+    title_tokens = tokens[:anchor] if tags_started else tokens
+
+    for token in tokens[anchor:] if tags_started else ():
+        lowered = token.lower()
+        # "x264-GRP" style: the release group hangs off the last tag
+        if '-' in lowered and lowered not in RELEASE_SOURCES:
+            token, parsed["releaseGroup"] = token.rsplit('-', 1)
+            lowered = token.lower()
+
+        resolution = RELEASE_RESOLUTION_RE.match(lowered)
+        episode = RELEASE_EPISODE_RE.match(lowered)
+        if RELEASE_YEAR_RE.match(lowered):
+            parsed["year"] = parsed["year"] or int(lowered)
+        elif resolution:
+            number, word = resolution.groups()
+            parsed["quality"] = RELEASE_RESOLUTION_NAMES.get(number or word, f"{number}p")
+        elif episode:
+            parsed["season"] = int(episode.group(1))
+            parsed["episode"] = int(episode.group(2)) if episode.group(2) else None
+        elif lowered in RELEASE_SOURCES:
+            parsed["source"] = parsed["source"] or token
+        elif lowered in RELEASE_CODECS:
+            parsed["codec"] = parsed["codec"] or token
+        elif lowered in RELEASE_LANGUAGES:
+            languages.append(RELEASE_LANGUAGES[lowered])
+        elif lowered in RELEASE_MULTI_LANGUAGE:
+            languages.append(None)
+
+    # "Jawan Hindi 720p": a trailing language belongs to the tags. Trailing filler
+    # ("Jawan Full Movie") is dropped too, but may be a real title word ("Tom and
+    # Jerry The Movie"), so that title, like one holding a source or codec word
+    # ("Dark Web", "Jawan WEBRip 720p"), is left for the AI to confirm.
+    doubtful = False
+    while len(title_tokens) > 1:
+        lowered = title_tokens[-1].lower()
+        if lowered in RELEASE_LANGUAGES:
+            languages.append(RELEASE_LANGUAGES[lowered])
+        elif lowered in RELEASE_MULTI_LANGUAGE:
+            languages.append(None)
+        elif lowered in RELEASE_FILLER_WORDS:
+            doubtful = True
+        else:
+            break
+        title_tokens = title_tokens[:-1]
+    doubtful = doubtful or any(token.lower() in RELEASE_FILLER_WORDS | RELEASE_SOURCES | RELEASE_CODECS for token in title_tokens)
+
+    if title_tokens:
+        title = ' '.join(token.capitalize() if token.islower() else token for token in title_tokens)
+        if parsed["season"] is not None:
+            title += f" S{parsed['season']:02d}" + (f"E{parsed['episode']:02d}" if parsed["episode"] is not None else "")
+        parsed["groupName"] = title
+    if len(set(languages)) == 1 and languages[0]:
+        parsed["lang"] = languages[0]
+
+    # Title boundary found + quality + an unambiguous language is enough to skip the AI
+    confidence = 0.0
+    if title_tokens and tags_started and not doubtful and any(c.isalpha() for c in parsed["groupName"]):
+        confidence += 0.4
+    if parsed["quality"]:
+        confidence += 0.3
+    if parsed["lang"]:
+        confidence += 0.2
+    if parsed["year"] or parsed["season"] is not None:
+        confidence += 0.1
+    parsed["confidence"] = round(confidence, 2)
+    return parsed
+
+# --- Catalog Indexes ---
+# Derived views of files_store, kept in sync through its change hook. Subclasses
+# implement add(group_id, group) and remove(group_id). Nothing is built at
+# import: build_in_background() indexes the catalog in INDEX_BUILD_CHUNK slices
+# so the bot keeps answering meanwhile, and ensure_built() builds it in one go on
+# first use for indexes nobody warmed up.
+class CatalogIndex:
+    built = False
+    building = False
+
+    def rebuild(self, items):
+        self.__init__()
+        for group_id, group in items:
+            self.add(group_id, group)
+        self.built = True
+
+    def ensure_built(self):
+        if not self.built and not self.building:
+            started = time.monotonic()
+            self.rebuild(files_store.items())
+            logger.info(f"Built {type(self).__name__} over {len(files_store)} groups in {time.monotonic() - started:.2f}s")
+
+    async def build_in_background(self):
+        if self.built or self.building: return
+        started = time.monotonic()
+        self.__init__()
+        self.building = True
+        group_ids = list(files_store.data)
+        for i in range(0, len(group_ids), INDEX_BUILD_CHUNK):
+            for group_id in group_ids[i:i + INDEX_BUILD_CHUNK]:
+                group = files_store.get(group_id) # Current value; on_change has already applied newer edits
+                if group is not None:
+                    self.add(group_id, group)
+            await asyncio.sleep(0)
+        self.building, self.built = False, True
+        logger.info(f"Built {type(self).__name__} over {len(group_ids)} groups in {time.monotonic() - started:.2f}s (background)")
+
+    def on_change(self, op):
+        if not self.built and not self.building: return # Picked up by the first build
+        if op[0] == "s":
+            self.add(op[1], op[2])
+        elif op[0] == "d":
+            self.remove(op[1])
+        elif op[0] == "c":
+            self.rebuild(())
+
+# --- 5b. SEARCH INDEX ---
+# Inverted index over group titles and file names. Every word is indexed whole
+# and by its prefixes (SEARCH_MIN_GRAM and up), so partial words still match.
+# Queries intersect the posting lists of all their words and rank with BM25.
+# Kept in sync with files_store through its change hook.
+class SearchIndex(CatalogIndex):
+    K1 = 1.2
+    B = 0.75
+
+    def __init__(self):
+        self.postings = {}   # term -> {group_id: weighted term frequency}
+        self.doc_terms = {}  # group_id -> {term: weighted term frequency}
+        self.doc_len = {}
+        self.total_len = 0
+
+    @staticmethod
+    def _grams(token):
+        yield token
+        for i in range(SEARCH_MIN_GRAM, len(token)):
+            yield token[:i]
+
+    def _terms(self, group):
+        terms = {}
+        def add(text, weight):
+            for token in tokenize(text):
+                for term in self._grams(token):
+                    terms[term] = terms.get(term, 0) + weight
+        add(group.get("groupName", ""), 2) # Title words count double
+        for qualities in group.get("languages", {}).values():
+            for file in qualities.values():
+                add(file.get("fileName", ""), 1)
+        return terms
+
+    def add(self, group_id, group):
+        self.remove(group_id)
+        terms = self._terms(group)
+        self.doc_terms[group_id] = terms
+        self.doc_len[group_id] = length = sum(terms.values())
+        self.total_len += length
+        for term, tf in terms.items():
+            self.postings.setdefault(term, {})[group_id] = tf
+
+    def remove(self, group_id):
+        terms = self.doc_terms.pop(group_id, None)
+        if terms is None: return
+        self.total_len -= self.doc_len.pop(group_id)
+        for term in terms:
+            posting = self.postings[term]
+            del posting[group_id]
+            if not posting:
+                del self.postings[term]
+
+    # Used only while the index is still warming up: every query word must start
+    # some title word; shorter titles rank first
+    def _scan(self, query, limit):
+        terms = tokenize(query)
+        if not terms: return []
+        scored = []
+        for group_id, group in files_store.items():
+            words = (group.get("searchAll") or normalize_query(group["groupName"])).split()
+            if all(any(word.startswith(term) for word in words) for term in terms):
+                scored.append((1 / len(words), group_id))
+        return heapq.nlargest(limit, scored)
+
+    def search(self, query, limit=SEARCH_TOP_K):
+        if self.building:
+            return self._scan(query, limit)
+        self.ensure_built()
+        terms = list(dict.fromkeys(tokenize(query)))
+        if not terms: return []
+        postings = [self.postings.get(term) for term in terms]
+        if not all(postings): return []
+
+        # Intersect starting from the rarest term
+        postings.sort(key=len)
+        rarest, rest = postings[0], postings[1:]
+        candidates = [group_id for group_id in rarest if all(group_id in posting for posting in rest)]
+        if not candidates: return []
+
+        n = len(self.doc_terms)
+        avg_len = self.total_len / n
+        idfs = [math.log(1 + (n - len(posting) + 0.5) / (len(posting) + 0.5)) for posting in postings]
+        scored = []
+        for group_id in candidates:
+            norm = self.K1 * (1 - self.B + self.B * self.doc_len[group_id] / avg_len)
+            score = 0.0
+            for idf, posting in zip(idfs, postings):
+                tf = posting[group_id]
+                score += idf * tf * (self.K1 + 1) / (tf + norm)
+            scored.append((score, group_id))
+        return heapq.nlargest(limit, scored)
+
+search_index = SearchIndex()
+files_store.watch(search_index.on_change)
+
+# --- 5c. FUZZY MATCHER ---
+# Typo-tolerant title lookup used before the AI fallback. Titles are split into
+# padded word trigrams ("jawan" -> "  j", " ja", "jaw", "awa", "wan", "an ") and
+# compared with Jaccard similarity, like Postgres pg_trgm.
+class FuzzyMatcher(CatalogIndex):
+    def __init__(self):
+        self.postings = {}   # trigram -> set of group_ids
+        self.doc_grams = {}  # group_id -> frozenset of trigrams
+
+    @staticmethod
+    def _grams(text):
+        grams = set()
+        for token in tokenize(text):
+            padded = f"  {token} "
+            grams.update(padded[i:i + 3] for i in range(len(padded) - 2))
+        return frozenset(grams)
+
+    def add(self, group_id, group):
+        grams = self._grams(group.get("groupName", ""))
+        if self.doc_grams.get(group_id) == grams: return
+        self.remove(group_id)
+        self.doc_grams[group_id] = grams
+        for gram in grams:
+            self.postings.setdefault(gram, set()).add(group_id)
+
+    def remove(self, group_id):
+        grams = self.doc_grams.pop(group_id, None)
+        if grams is None: return
+        for gram in grams:
+            posting = self.postings[gram]
+            posting.discard(group_id)
+            if not posting:
+                del self.postings[gram]
+
+    def match(self, query, limit=FUZZY_TOP_K, min_score=FUZZY_MIN_SCORE):
+        self.ensure_built()
+        grams = self._grams(query)
+        if not grams: return []
+
+        # Jaccard can't reach min_score unless `needed` query trigrams are shared,
+        # so only the rarest trigrams may introduce candidates (prefix filtering);
+        # common ones like "  m" only add to candidates already found.
+        needed = math.ceil(min_score * len(grams))
+        ordered = sorted(grams, key=lambda gram: len(self.postings.get(gram, ())))
+        seeds = len(ordered) - needed + 1
+        overlap = {}
+        for gram in ordered[:seeds]:
+            for group_id in self.postings.get(gram, ()):
+                overlap[group_id] = overlap.get(group_id, 0) + 1
+        for gram in ordered[seeds:]:
+            posting = self.postings.get(gram, ())
+            for group_id in overlap:
+                if group_id in posting:
+                    overlap[group_id] += 1
+
+        scored = []
+        for group_id, common in overlap.items():
+            if common < needed: continue
+            score = common / (len(grams) + len(self.doc_grams[group_id]) - common)
+            if score >= min_score:
+                scored.append((score, group_id))
+        return heapq.nlargest(limit, scored)
+
+fuzzy_matcher = FuzzyMatcher()
+files_store.watch(fuzzy_matcher.on_change)
+
+# --- 5d. INDEXED FILES ---
+# Every file already in the catalog, keyed by Telegram fileId, by file_unique_id
+# (the same across re-posts and forwards, where fileId changes) and by
+# file_fingerprint(), each pointing at the group/lang/quality slot holding it.
+# /index skips these files and the indexer reuses their slot without asking the AI.
+class FileIdIndex(CatalogIndex):
+    def __init__(self):
+        self.slots = {}     # ("id", fileId) / ("uid", fileUniqueId) / ("fp", size, name) -> (group_id, lang, quality)
+        self.doc_keys = {}  # group_id -> keys it owns
+
+    @staticmethod
+    def _keys(file_id, unique_id, file_size, file_name):
+        keys = [("id", file_id)]
+        if unique_id:
+            keys.append(("uid", unique_id))
+        fingerprint = file_fingerprint(file_size, file_name)
+        if fingerprint:
+            keys.append(("fp", *fingerprint))
+        return keys
+
+    def add(self, group_id, group):
+        self.remove(group_id)
+        keys = []
+        for lang, qualities in group.get("languages", {}).items():
+            for quality, file in qualities.items():
+                for key in self._keys(file["fileId"], file.get("fileUniqueId"), file.get("fileSize"), file.get("fileName")):
+                    self.slots[key] = (group_id, lang, quality)
+                    keys.append(key)
+        self.doc_keys[group_id] = keys
+
+    def remove(self, group_id):
+        for key in self.doc_keys.pop(group_id, ()):
+            if self.slots.get(key, (None,))[0] == group_id:
+                del self.slots[key]
+
+    # file: a pyrogram Document/Video -> (group_id, lang, quality) or None
+    def lookup(self, file):
+        self.ensure_built()
+        for key in self._keys(file.file_id, file.file_unique_id, file.file_size, file.file_name):
+            slot = self.slots.get(key)
+            if slot:
+                return slot
+        return None
+
+    def __contains__(self, file_id):
+        self.ensure_built()
+        return ("id", file_id) in self.slots
+
+file_id_index = FileIdIndex()
+files_store.watch(file_id_index.on_change)
+
+# --- 5e. SEARCH WORKER PROCESSES ---
+# With SEARCH_WORKER_PROCESSES > 0, search and fuzzy lookups run in a process
+# pool so they use more than one core. This process stays the only writer: it
+# owns Telegram and every store and sends workers just (kind, query, limit); they
+# return ranked group IDs. Each worker keeps a read-only CatalogReplica
+# of files_store plus its own indexes. Before every query the replica catches up
+# with what the writer has flushed (at most STORE_JOURNAL_INTERVAL behind):
+#   json   - tails "<path>.journal" from its last byte offset, and reloads the
+#            snapshot when a compaction replaced it or truncated the journal.
+#   sqlite - reads keys changed since its last seq from catalog_changes, and
+#            reloads everything if it fell further behind than the log goes.
+class CatalogReplica:
+    def __init__(self, storage_backend):
+        self.storage_backend = storage_backend
+        self.signature = None # json: snapshot + binary snapshot identity; sqlite: True once loaded
+        self.position = 0     # json: journal byte offset; sqlite: last seq applied
+        self.journal_ino = 0  # json: inode of the journal that position refers to
+        self.backend = None   # sqlite: kept open between queries
+
+    def _apply(self, op):
+        ResidentStore._apply_to(files_store.data, op)
+        for callback in files_store._watchers:
+            callback(op)
+
+    def _reload(self, data):
+        files_store.data = data
+        if self.storage_backend != "sqlite": # SQLite searches go to its FTS table
+            search_index.rebuild(files_store.items())
+        fuzzy_matcher.rebuild(files_store.items())
+
+    def sync(self):
+        if self.storage_backend == "sqlite":
+            self._sync_sqlite()
+        else:
+            self._sync_json()
+
+    @staticmethod
+    def _identity(path):
+        if not os.path.exists(path): return (0, 0)
+        stat = os.stat(path)
+        return stat.st_ino, stat.st_mtime_ns
+
+    def _sync_json(self):
+        backend = JsonBackend("files", DB_PATH_FILES)
+        # Journal first: if a compaction lands in between, the snapshot loaded
+        # below is the newer one and the next call sees the journal rotated
+        journal_ino, _ = self._identity(backend.journal_path)
+        journal_size = os.path.getsize(backend.journal_path) if journal_ino else 0
+        signature = tuple(self._identity(path) for path in (backend.path, backend.binary_path) if path)
+        if signature != self.signature:
+            # Ops past journal_size may be applied twice below; they are
+            # whole-value sets/deletes, so that is harmless
+            data, replayed = backend.load(ResidentStore._apply_to)
+            self.signature, self.journal_ino, self.position = signature, journal_ino, journal_size
+            self._reload(data)
+            return
+        try:
+            f = open(backend.journal_path, 'rb')
+        except FileNotFoundError:
+            return
+        with f:
+            stat = os.fstat(f.fileno())
+            if stat.st_ino != self.journal_ino: # Rotated: everything in it postdates our snapshot
+                self.journal_ino, self.position = stat.st_ino, 0
+            if stat.st_size < self.position: # Truncated in place (not done by this version): start over
+                self.signature = None
+                return self._sync_json()
+            if stat.st_size == self.position: return
+            f.seek(self.position)
+            chunk = f.read(stat.st_size - self.position)
+        complete = chunk[:chunk.rfind(b"\n") + 1] # A line may still be half-written
+        for line in complete.splitlines():
+            try:
+                self._apply(json.loads(line))
+            except ValueError:
+                pass
+        self.position += len(complete)
+
+    def _sync_sqlite(self):
+        if self.backend is None:
+            self.backend = SqliteBackend("files", catalog=True)
+        db = self.backend.connect()
+        first, last = db.execute("SELECT MIN(seq), MAX(seq) FROM catalog_changes").fetchone()
+        if self.signature and (last is None or last == self.position): return
+        changes = db.execute("SELECT seq, key FROM catalog_changes WHERE seq > ? ORDER BY seq", (self.position,)).fetchall()
+        if not self.signature or first > self.position + 1 or any(key == "" for seq, key in changes):
+            # last was read before the data: changes in between get re-fetched next time
+            data, replayed = self.backend.load(None)
+            self.signature, self.position = True, last or 0
+            self._reload(data)
+            return
+        for key in dict.fromkeys(key for seq, key in changes):
+            row = db.execute(f"SELECT value FROM {self.backend.table} WHERE key = ?", (key,)).fetchone()
+            self._apply(["s", key, json.loads(row[0])] if row else ["d", key])
+        self.position = changes[-1][0]
+
+search_replica = None # Set in worker processes only
+
+def init_search_worker(storage_backend):
+    global search_replica
+    logging.getLogger(__name__).setLevel(logging.WARNING)
+    search_replica = CatalogReplica(storage_backend)
+    search_replica.sync()
+
+def search_in_worker(kind, query, limit): # Title searches only come here with JSON storage
+    search_replica.sync()
+    if kind == "fuzzy":
+        return fuzzy_matcher.match(query, limit)
+    return search_index.search(query, limit)
+
+class SearchWorkerPool:
+    def __init__(self, processes=SEARCH_WORKER_PROCESSES):
+        self.processes = processes
+        self._pool = None
+
+    @property
+    def enabled(self):
+        return self._pool is not None
+
+    def start(self):
+        if self.processes <= 0 or self._pool: return
+        # spawn, not fork: this process has live threads and an event loop
+        self._pool = ProcessPoolExecutor(self.processes, mp_context=multiprocessing.get_context("spawn"),
+                                         initializer=init_search_worker, initargs=(STORAGE_BACKEND,))
+        logger.info(f"Search: started {self.processes} worker processes")
+
+    async def run(self, kind, query, limit):
+        return await asyncio.get_running_loop().run_in_executor(self._pool, search_in_worker, kind, query, limit)
+
+    def close(self):
+        if self._pool:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+search_workers = SearchWorkerPool()
+
+async def search_group_ids(query, limit=SEARCH_TOP_K):
+    if isinstance(files_store.backend, SqliteBackend):
+        return await files_store.backend.search_titles(query, limit)
+    if search_workers.enabled:
+        return await search_workers.run("search", query, limit)
+    return search_index.search(query, limit)
+
+async def fuzzy_group_ids(query, limit=FUZZY_TOP_K):
+    if search_workers.enabled:
+        return await search_workers.run("fuzzy", query, limit)
+    return fuzzy_matcher.match(query, limit)
+
+# One running instance per data directory: the stores are only safe with a
+# single writer. The returned file must stay open for the lock to hold.
+def acquire_writer_lock():
+    if fcntl is None: return None
+    lock_file = open(WRITER_LOCK_PATH, 'w')
+    try:
+        fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        lock_file.close()
+        raise SystemExit(f"Another instance of the bot is already running here ({WRITER_LOCK_PATH} is locked).")
+    return lock_file
+
 # --- FILE 1: bot.py (Part 2 of 3) ---
 # --- Copy this part after Part 1 ---
 
@@ -229,17 +1913,295 @@ async def process_file_for_indexing(file_message: Message):
 # --- 6. BOT LOGIC (HANDLERS) ---
 # -----------------------------------------------------------------
 
+# --- Callback Tokens ---
+# Buttons carry a 12-character token instead of titles or IDs, so callback_data
+# stays far below Telegram's 64-byte limit and needs no parsing. The token is a
+# hash of the payload tuple (the same button always gets the same token) and
+# resolves through an in-memory LRU table with one dictionary lookup.
+class CallbackTokens:
+    def __init__(self, max_entries=CALLBACK_TOKEN_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self.payloads = OrderedDict() # token -> ("lang", group_id, lang) | ("qual", group_id, lang, quality) | ("pick", group_id, lang, quality)
+                                      #          | ("page", query, lang, quality, page) | ("request", title)
+
+    def issue(self, *payload):
+        digest = hashlib.blake2b(json.dumps(payload).encode('utf-8'), digest_size=9).digest()
+        token = base64.urlsafe_b64encode(digest).decode('ascii')
+        if token in self.payloads:
+            self.payloads.move_to_end(token)
+        else:
+            self.payloads[token] = payload
+            if len(self.payloads) > self.max_entries:
+                self.payloads.popitem(last=False)
+        return token
+
+    def resolve(self, token):
+        return self.payloads.get(token)
+
+callback_tokens = CallbackTokens()
+
 # --- 6a. AI INDEXER (NEW FILES IN CHANNEL) ---
+# Posts are queued per chat and classified together once BATCH_PROCESS_DELAY
+# passes without the batch filling up (or as soon as INDEX_BATCH_SIZE is reached).
 @bot_app.on_message(filters.chat(ADMIN_CHAT_ID) & (filters.document | filters.video) & filters.channel)
 async def handle_channel_post(client: Client, message: Message):
-    logger.info(f"AI Indexer: Detected new file in channel: {message.chat.id}")
-    result = await process_file_for_indexing(message)
-    if result["status"] == "success":
-        await bot_app.send_message(message.chat.id, f'AI Indexed: {result["groupName"]} ({result["lang"]} / {result["quality"]})')
-    else:
-        await bot_app.send_message(message.chat.id, f'AI Indexing failed for "{result.get("fileName", "Unknown")}". Error: {result["error"]}')
+    chat_id = message.chat.id
+    logger.info(f"AI Indexer: Detected new file in channel: {chat_id}")
+    queue = admin_batch_queues.setdefault(chat_id, [])
+    queue.append(message)
+
+    if len(queue) >= INDEX_BATCH_SIZE:
+        await flush_channel_batch(chat_id)
+    elif chat_id not in admin_batch_timers:
+        admin_batch_timers[chat_id] = asyncio.create_task(channel_batch_timer(chat_id))
+
+async def channel_batch_timer(chat_id):
+    await asyncio.sleep(BATCH_PROCESS_DELAY / 1000.0)
+    admin_batch_timers.pop(chat_id, None)
+    await flush_channel_batch(chat_id)
+
+async def flush_channel_batch(chat_id):
+    timer = admin_batch_timers.pop(chat_id, None)
+    if timer and timer is not asyncio.current_task():
+        timer.cancel()
+    batch = admin_batch_queues.pop(chat_id, [])
+    if not batch: return
+
+    results = await process_files_for_indexing(batch)
+    for result in results:
+        metrics.inc("index_files_total", source="channel", result=result["status"])
+    if len(results) == 1:
+        result = results[0]
+        if result["status"] == "success":
+            await bot_app.send_message(chat_id, f'AI Indexed: {result["groupName"]} ({result["lang"]} / {result["quality"]})')
+        elif result["status"] == "duplicate":
+            await bot_app.send_message(chat_id, f'Already indexed: {result["groupName"]} ({result["lang"]} / {result["quality"]}), kept the existing file.')
+        else:
+            await bot_app.send_message(chat_id, f'AI Indexing failed for "{result.get("fileName", "Unknown")}". Error: {result["error"]}')
+        return
+
+    lines = []
+    for result in results:
+        if result["status"] == "success":
+            lines.append(f'✅ {result["groupName"]} ({result["lang"]} / {result["quality"]})')
+        elif result["status"] == "duplicate":
+            lines.append(f'⏭️ {result["groupName"]} ({result["lang"]} / {result["quality"]}): already indexed')
+        else:
+            lines.append(f'❌ "{result.get("fileName", "Unknown")}": {result["error"]}')
+    successes = sum(1 for result in results if result["status"] == "success")
+    await bot_app.send_message(chat_id, f"AI Indexed {successes} / {len(results)} files:\n" + "\n".join(lines))
 
 # --- 6b. AI SCRAPER (OLD FILES /INDEX COMMAND) ---
+# Pipeline: one producer pages the channel history into batches, SCRAPE_WORKERS
+# workers classify batches concurrently, and a single committer applies them to
+# the catalog. Both queues are bounded, so paging waits for classification
+# instead of buffering a whole channel. Progress is reported on its own timer.
+#
+# Every job is checkpointed in scrape_jobs_store. History is paged newest to
+# oldest; "offsetId" is the oldest message whose batch, and every batch before
+# it, has been committed, so paging resumes below it after a FloodWait, a crash
+# or /index resume. A finished job remembers its newest message as "floorId",
+# making the next /index of that channel only look at newer posts.
+class ScrapeJob:
+    active = None # The running job, for the queue-depth gauges
+
+    def __init__(self, chat_id, status_msg, state=None):
+        state = state or {}
+        self.chat_id = chat_id
+        self.status_msg = status_msg
+        self.offset_id = state.get("offsetId", 0)
+        self.top_id = state.get("topId", 0)
+        self.floor_id = state.get("floorId", 0)
+        self.total_files = state.get("totalFiles", 0)
+        self.successes = state.get("successes", 0)
+        self.failures = state.get("failures", 0)
+        self.skipped = state.get("skipped", 0)
+        self.new_groups = set(state.get("newGroups", []))
+        self.done = False
+        self._next_seq = 0
+        self._batch_floors = {} # seq -> oldest message id in that batch
+        self._committed = set()
+        self.queues = {}
+
+    @classmethod
+    def for_channel(cls, chat_id, status_msg):
+        # Continue an interrupted job, or start an incremental one after a finished job
+        state = scrape_jobs_store.get(str(chat_id))
+        if state and state.get("status") != "done":
+            return cls(chat_id, status_msg, state)
+        return cls(chat_id, status_msg, {"floorId": state["topId"] or state.get("floorId", 0)} if state else None)
+
+    @property
+    def resumed(self):
+        return bool(self.offset_id)
+
+    def checkpoint(self):
+        scrape_jobs_store.set(str(self.chat_id), {
+            "chatId": self.chat_id,
+            "status": "done" if self.done else "running",
+            "offsetId": self.offset_id,
+            "topId": self.top_id,
+            "floorId": self.floor_id,
+            "totalFiles": self.total_files,
+            "successes": self.successes,
+            "failures": self.failures,
+            "skipped": self.skipped,
+            "newGroups": sorted(self.new_groups),
+            "updatedAt": int(time.time())
+        })
+
+    async def run(self):
+        self.checkpoint()
+        batches = asyncio.Queue(maxsize=SCRAPE_QUEUE_SIZE)
+        classified = asyncio.Queue(maxsize=SCRAPE_QUEUE_SIZE)
+        workers = [asyncio.create_task(self._classify_worker(batches, classified)) for _ in range(SCRAPE_WORKERS)]
+        committer = asyncio.create_task(self._commit_results(classified))
+        progress = asyncio.create_task(self._report_progress())
+        self.queues = {"batches": batches, "classified": classified}
+        ScrapeJob.active = self
+        try:
+            await self._produce(batches)
+        finally:
+            # Batches already paged in still get indexed, even if paging failed
+            for _ in workers:
+                await batches.put(None)
+            await asyncio.gather(*workers)
+            await classified.put(None)
+            await committer
+            progress.cancel()
+            ScrapeJob.active = None
+
+        self.done = True
+        self.floor_id, self.offset_id = self.top_id or self.floor_id, 0 # A run that found nothing new keeps the old floor
+        self.checkpoint()
+
+    async def _produce(self, batches):
+        batch = []
+        paged_id = self.offset_id
+        while True:
+            try:
+                client = await ensure_user_app()
+                async for file_msg in client.get_chat_history(self.chat_id, offset_id=paged_id):
+                    if file_msg.id <= self.floor_id:
+                        break # Reached what the last finished run already covered
+                    if not self.top_id:
+                        self.top_id = file_msg.id
+                    paged_id = file_msg.id
+
+                    if file_msg.document or file_msg.video:
+                        if file_id_index.lookup(file_msg.document or file_msg.video):
+                            self.skipped += 1
+                            metrics.inc("index_files_total", source="scrape", result="skipped")
+                            continue
+                        self.total_files += 1
+                        batch.append(file_msg)
+                        if len(batch) >= INDEX_BATCH_SIZE:
+                            await self._enqueue(batches, batch)
+                            batch = []
+                break
+            except FloodWait as e:
+                # Wait it out, then keep paging from the last message we saw
+                record_flood_wait("scrape", e)
+                logger.warning(f"Scraper: FloodWait while paging {self.chat_id}. Sleeping for {e.value} seconds.")
+                try:
+                    await self.status_msg.edit(f"FloodWait: Sleeping for {e.value} seconds... Task will resume.\n\n{self.progress_text()}")
+                except Exception:
+                    pass
+                await asyncio.sleep(e.value)
+        if batch:
+            await self._enqueue(batches, batch)
+
+    async def _enqueue(self, batches, batch):
+        seq = self._next_seq
+        self._next_seq += 1
+        self._batch_floors[seq] = batch[-1].id
+        await batches.put((seq, batch))
+
+    async def _classify_worker(self, batches, classified):
+        while True:
+            item = await batches.get()
+            if item is None: return
+            seq, batch = item
+            with metrics.timer("index_batch_seconds"):
+                ai_responses = await classify_file_messages(batch)
+            await classified.put((seq, batch, ai_responses))
+
+    async def _commit_results(self, classified):
+        checkpoint_seq = 0
+        while True:
+            item = await classified.get()
+            if item is None: return
+            seq, batch, ai_responses = item
+            for result in apply_indexed_files(batch, ai_responses):
+                metrics.inc("index_files_total", source="scrape", result=result["status"])
+                if result["status"] == "success":
+                    self.successes += 1
+                    if result["isNewGroup"]:
+                        self.new_groups.add(result["groupName"])
+                elif result["status"] == "duplicate":
+                    self.skipped += 1
+                else:
+                    self.failures += 1
+
+            # Workers finish out of order; only advance over a committed prefix
+            self._committed.add(seq)
+            while checkpoint_seq in self._committed:
+                self._committed.remove(checkpoint_seq)
+                self.offset_id = self._batch_floors.pop(checkpoint_seq)
+                checkpoint_seq += 1
+            self.checkpoint()
+
+    def progress_text(self):
+        return f"Scraping...\nFiles Found: {self.total_files}\nSuccessfully Indexed: {self.successes}\nFailed: {self.failures}\nAlready Indexed (skipped): {self.skipped}"
+
+    async def _report_progress(self):
+        last_text = None
+        while True:
+            await asyncio.sleep(SCRAPE_PROGRESS_INTERVAL)
+            text = self.progress_text()
+            if text == last_text: continue
+            try:
+                await self.status_msg.edit(text)
+                last_text = text
+            except FloodWait as e:
+                record_flood_wait("scrape", e)
+                await asyncio.sleep(e.value)
+            except Exception as e:
+                logger.warning(f"Scraper: Could not update progress message: {e}")
+
+    def report(self):
+        report = f"✅ **Scraping Complete!**\n\n"
+        report += f"Total Messages Found: **{self.total_files}**\n"
+        report += f"Successfully Indexed: **{self.successes}** files\n"
+        report += f"Failed: **{self.failures}** files\n"
+        report += f"Already Indexed (skipped): **{self.skipped}** files\n"
+        if self.new_groups:
+            report += f"\nNew Groups Added: **{len(self.new_groups)}**\n- " + "\n- ".join(list(self.new_groups)[:20])
+            if len(self.new_groups) > 20:
+                report += f"\n...and {len(self.new_groups) - 20} more."
+        return report
+
+def unfinished_scrape_jobs():
+    return [state["chatId"] for state in scrape_jobs_store.values() if state.get("status") != "done"]
+
+async def run_scrape_job(chat_id, status_msg):
+    try:
+        # @name, -100… and t.me links for one channel share a single checkpoint
+        chat = await (await ensure_user_app()).get_chat(chat_id)
+    except Exception as e:
+        logger.error(f"Scraper: Could not resolve {chat_id}: {e}")
+        await status_msg.edit(f"Could not find channel {chat_id}: {e}")
+        return
+    job = ScrapeJob.for_channel(chat.id, status_msg)
+    if job.resumed:
+        logger.info(f"Scraper: Resuming {chat.id} below message {job.offset_id}")
+    try:
+        await job.run()
+        await status_msg.edit(job.report())
+    except Exception as e:
+        logger.error(f"Error during scraping: {e}")
+        await status_msg.edit(f"An error occurred during scraping: {e}\n\nProgress is saved. Send `/index resume` to continue.")
+
 @bot_app.on_message(filters.command("index") & filters.user(int(ADMIN_CHAT_ID)) & filters.private)
 async def handle_index_command(client: Client, message: Message):
     if scrape_lock.locked():
@@ -247,61 +2209,132 @@ async def handle_index_command(client: Client, message: Message):
         return
 
     try:
-        chat_id = message.text.split(" ", 1)[1] # Get channel link/ID
+        chat_id = message.text.split(" ", 1)[1].strip() # Get channel link/ID
     except IndexError:
-        await message.reply("Usage: `/index [channel_link_or_id]`")
+        await message.reply("Usage: `/index [channel_link_or_id]`\nOr `/index resume` to continue interrupted jobs.")
         return
 
     async with scrape_lock:
-        status_msg = await message.reply(f"Starting to scrape channel: {chat_id}. This may take a long time...")
-        logger.info(f"Scraper: Admin triggered /index for {chat_id}")
-        
-        total_files = 0
-        successes = 0
-        failures = 0
-        new_groups = set()
-        db_before = await load_db(DB_PATH_FILES)
+        if chat_id.lower() == "resume":
+            chat_ids = unfinished_scrape_jobs()
+            if not chat_ids:
+                await message.reply("There are no interrupted scraping jobs.")
+                return
+        else:
+            chat_ids = [chat_id]
 
-        try:
-            async for file_msg in user_app.get_chat_history(chat_id):
-                if file_msg.document or file_msg.video:
-                    total_files += 1
-                    result = await process_file_for_indexing(file_msg)
-                    
-                    if result["status"] == "success":
-                        successes += 1
-                        if result["isNewGroup"]:
-                            new_groups.add(result["groupName"])
-                    else:
-                        failures += 1
-
-                    if total_files % 50 == 0: # Update every 50 files
-                        await status_msg.edit(f"Scraping...\nFiles Found: {total_files}\nSuccessfully Indexed: {successes}\nFailed: {failures}")
-                        await asyncio.sleep(1) # Small pause
-
-            # Send final report
-            report = f"✅ **Scraping Complete!**\n\n"
-            report += f"Total Messages Found: **{total_files}**\n"
-            report += f"Successfully Indexed: **{successes}** files\n"
-            report += f"Failed: **{failures}** files\n"
-            if new_groups:
-                report += f"\nNew Groups Added: **{len(new_groups)}**\n- " + "\n- ".join(list(new_groups)[:20])
-                if len(new_groups) > 20:
-                    report += f"\n...and {len(new_groups) - 20} more."
-            
-            await status_msg.edit(report)
+        for chat_id in chat_ids:
+            status_msg = await message.reply(f"Starting to scrape channel: {chat_id}. This may take a long time...")
+            logger.info(f"Scraper: Admin triggered /index for {chat_id}")
+            await run_scrape_job(chat_id, status_msg)
 
-        except FloodWait as e:
-            logger.warning(f"FloodWait: Sleeping for {e.value} seconds.")
-            await status_msg.edit(f"FloodWait: Sleeping for {e.value} seconds... Task will resume.")
-            await asyncio.sleep(e.value)
-        except Exception as e:
-            logger.error(f"Error during scraping: {e}")
-            await status_msg.edit(f"An error occurred during scraping: {e}")
+# Called once at startup: picks up jobs that a crash or restart cut short
+async def resume_scrape_jobs():
+    chat_ids = unfinished_scrape_jobs()
+    if not chat_ids: return
+    async with scrape_lock:
+        for chat_id in chat_ids:
+            status_msg = await bot_app.send_message(int(ADMIN_CHAT_ID), f"Resuming interrupted scrape of channel: {chat_id}...")
+            await run_scrape_job(chat_id, status_msg)
 
 # --- 6c. AI-POWERED USER SEARCH ---
+# Admission control, in order: a per-user token bucket (USER_SEARCH_BURST, then
+# USER_SEARCH_RATE per second), a cap on running searches so a spike can never
+# take every dispatcher worker away from admin commands, and single-flight, so
+# identical searches (same normalized query, language and quality) in flight at
+# the same time share one search and one AI fallback. The AI fallback has its
+# own smaller limit with a bounded queue; beyond it, searches are refused.
+class UserRateLimiter:
+    def __init__(self, rate=USER_SEARCH_RATE, burst=USER_SEARCH_BURST):
+        self.rate = rate
+        self.burst = burst
+        self.buckets = {} # user_id -> [tokens, updated, warned]
+
+    # "ok", "warn" (first refusal: tell the user) or "drop" (already told)
+    def check(self, user_id):
+        now = time.monotonic()
+        tokens, updated, warned = self.buckets.get(user_id) or (self.burst, now, False)
+        tokens = min(self.burst, tokens + (now - updated) * self.rate)
+        if tokens >= 1:
+            self.buckets[user_id] = [tokens - 1, now, False]
+            verdict = "ok"
+        else:
+            self.buckets[user_id] = [tokens, now, True]
+            verdict = "drop" if warned else "warn"
+        if len(self.buckets) > 10000:
+            # Buckets that have refilled hold no state worth keeping
+            self.buckets = {user: bucket for user, bucket in self.buckets.items() if bucket[0] + (now - bucket[1]) * self.rate < self.burst}
+        return verdict
+
+    def retry_after(self, user_id):
+        tokens = self.buckets.get(user_id, [self.burst])[0]
+        return max(1, math.ceil((1 - tokens) / self.rate))
+
+class LoadShedder:
+    def __init__(self, limit, max_waiting=0):
+        self.limit = limit
+        self.max_waiting = max_waiting
+        self.active = 0
+        self.waiting = 0
+        self._slots = asyncio.Semaphore(limit)
+
+    # False when the limit is reached and the queue is full: shed the work
+    async def acquire(self):
+        if self.active + self.waiting >= self.limit + self.max_waiting:
+            return False
+        self.waiting += 1
+        try:
+            await self._slots.acquire()
+        finally:
+            self.waiting -= 1
+        self.active += 1
+        return True
+
+    def release(self):
+        self.active -= 1
+        self._slots.release()
+
+class SingleFlight:
+    def __init__(self):
+        self.inflight = {} # key -> task
+
+    async def run(self, key, factory):
+        task = self.inflight.get(key)
+        if task:
+            metrics.inc("search_coalesced_total")
+        else:
+            task = self.inflight[key] = asyncio.create_task(factory())
+            task.add_done_callback(lambda done: self.inflight.pop(key) if self.inflight.get(key) is done else None)
+        return await asyncio.shield(task)
+
+user_limiter = UserRateLimiter()
+search_shedder = LoadShedder(USER_SEARCH_CONCURRENCY)
+ai_fallback_shedder = LoadShedder(AI_FALLBACK_CONCURRENCY, AI_FALLBACK_MAX_WAITING)
+search_flights = SingleFlight()
+
 @bot_app.on_message(filters.text & filters.private & ~filters.user(int(ADMIN_CHAT_ID)))
 async def handle_user_search(client: Client, message: Message):
+    user_id = message.from_user.id if message.from_user else message.chat.id
+    verdict = user_limiter.check(user_id)
+    if verdict != "ok":
+        metrics.inc("admission_rejected_total", reason="rate_limit")
+        if verdict == "warn":
+            await message.reply(f"You're sending searches too fast. Please wait {user_limiter.retry_after(user_id)} seconds and try again.")
+        return
+
+    if not await search_shedder.acquire():
+        metrics.inc("admission_rejected_total", reason="overload")
+        await message.reply("The bot is very busy right now. Please try again in a minute.")
+        return
+    try:
+        await answer_search(message)
+    finally:
+        search_shedder.release()
+    if "firstAnswer" not in startup_timings:
+        mark_startup("firstAnswer")
+        logger.info(f"Startup: first search answered {startup_timings['firstAnswer']}s after launch")
+
+async def answer_search(message: Message):
     chat_id = message.chat.id
     original_query = message.text.lower()
     
@@ -311,7 +2344,7 @@ async def handle_user_search(client: Client, message: Message):
     detected_qual = None
     final_search_words = []
     
-    for word in original_query.split(' '):
+    for word in tokenize(original_query):
         if word in IGNORE_WORDS: continue
         mapped_lang = LANGUAGE_MAP.get(word)
         if mapped_lang:
@@ -323,92 +2356,189 @@ async def handle_user_search(client: Client, message: Message):
             continue
         final_search_words.append(word)
     
-    cleaned_query = ' '.join(final_search_words).replace(r'[^a-z0-9 ]', '')
+    cleaned_query = ' '.join(final_search_words)
     
     if len(cleaned_query) < 3:
         await message.reply("Search term must be 3+ chars.")
         return
 
-    results = await run_search(cleaned_query)
+    cache_key = result_cache.make_key(cleaned_query, detected_lang, detected_qual)
+    entry = result_cache.get(cache_key)
+    if not entry:
+        entry = await search_flights.run(cache_key, lambda: resolve_search(message, cleaned_query, original_query, cache_key))
+
+    if entry["groupIds"]:
+        await handle_search_results(chat_id, cache_key, entry)
+    else:
+        # Final failure: Show Request button
+        final_query_to_request = entry["queryUsed"]
+        keyboard = InlineKeyboardMarkup([[InlineKeyboardButton(f'Yes, request "{final_query_to_request}"', callback_data=callback_tokens.issue("request", final_query_to_request))]])
+        if entry.get("aiBusy"):
+            text = f"Sorry, I couldn't find any files for '{final_query_to_request}', and my AI search is busy right now. Try again in a minute, or add it to my request list:"
+        else:
+            text = f"Sorry, I couldn't find any files for '{final_query_to_request}'.\n\nWould you like me to add it to my request list?"
+        await message.reply(text, reply_markup=keyboard)
+
+# Shared by every identical search in flight; `message` is the first asker's.
+# Hits go into result_cache; misses are returned with "groupIds": [] only.
+async def resolve_search(message, cleaned_query, original_query, cache_key):
+    with metrics.timer("bot_stage_seconds", stage="search"):
+        results = await run_search(cleaned_query)
     query_used = cleaned_query
+    notice = None
 
     if not results:
-        status_msg = await message.reply(f"No results for '{cleaned_query}'. Trying AI search...")
-        ai_prompt = f"A user's search for '{original_query}' failed. What movie title were they likely looking for? Respond with *only* the movie title."
-        
-        async with aiohttp.ClientSession() as session:
-            suggested_title = await call_gemini(session, ai_prompt, None, True)
+        # Typos ("jawaan", "pathan 2") usually resolve here without a network call
+        with metrics.timer("bot_stage_seconds", stage="fuzzy"):
+            matches = await fuzzy_group_ids(cleaned_query)
+        results = [files_store.get(group_id) for score, group_id in matches if group_id in files_store]
+        if results:
+            query_used = results[0]["groupName"]
+            notice = f"Did you mean '{query_used}'?"
+
+    if not results:
+        if not await ai_fallback_shedder.acquire():
+            metrics.inc("admission_rejected_total", reason="ai_overload")
+            return {"groupIds": [], "queryUsed": query_used, "aiBusy": True}
+        try:
+            status_msg = await message.reply(f"No results for '{cleaned_query}'. Trying AI search...")
+            ai_prompt = f"A user's search for '{original_query}' failed. What movie title were they likely looking for? Respond with *only* the movie title."
+            
+            with metrics.timer("bot_stage_seconds", stage="ai_fallback"):
+                suggested_title = await call_gemini(ai_prompt, None, True)
+        finally:
+            ai_fallback_shedder.release()
         
         if suggested_title:
-            clean_suggested_title = suggested_title.replace(r'["\'.]', '').lower()
-            results = await run_search(clean_suggested_title)
+            clean_suggested_title = normalize_query(suggested_title)
+            with metrics.timer("bot_stage_seconds", stage="search"):
+                results = await run_search(clean_suggested_title)
             query_used = clean_suggested_title
             if results:
-                await status_msg.edit(f"Did you mean '{clean_suggested_title}'? Showing results:")
-            else:
-                await status_msg.delete()
-        else:
-            await status_msg.delete()
+                notice = f"Did you mean '{clean_suggested_title}'?"
+        await status_msg.delete()
 
-    if results:
-        await handle_search_results(chat_id, results, detected_lang, detected_qual)
-    else:
-        # Final failure: Show Request button
-        final_query_to_request = query_used
-        keyboard = InlineKeyboardMarkup([[InlineKeyboardButton(f'Yes, request "{final_query_to_request}"', callback_data=f"request_{final_query_to_request}")]])
-        await message.reply(f"Sorry, I couldn't find any files for '{final_query_to_request}'.\n\nWould you like me to add it to my request list?", reply_markup=keyboard)
+    if not results:
+        return {"groupIds": [], "queryUsed": query_used}
+    return result_cache.put(cache_key, [make_group_id(group["groupName"]) for group in results], notice)
 
 async def run_search(query):
-    db = await load_db(DB_PATH_FILES)
-    results = []
     if len(query) < 3: return []
-    for group_id, group in db.items():
-        if query in group.get("searchAll", ""):
-            results.append(group)
-    return results
+    groups = [files_store.get(group_id) for score, group_id in await search_group_ids(query)]
+    return [group for group in groups if group] # A worker may briefly know groups deleted here
 
-async def handle_search_results(chat_id, results, detected_lang, detected_qual):
-    for group in results:
-        group_name = group["groupName"]
-        group_id = group_name.lower().replace(r'[^a-z0-9]', '_').replace('__', '_')
-        available_languages = list(group["languages"].keys())
-        
-        if not available_languages: continue
+# Ranked group IDs per (normalized query, lang, quality), so page flips and
+# repeated popular queries skip the search. IDs (not groups) are cached and looked
+# up again when a page is rendered, so catalog edits show up immediately.
+class ResultCache:
+    def __init__(self, ttl=RESULT_CACHE_TTL, max_entries=RESULT_CACHE_MAX_ENTRIES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.entries = OrderedDict() # key -> {"groupIds", "notice", "expiresAt"}
 
-        # Case 1: "jawan hindi 4k" - Perfect match
-        if detected_lang and detected_qual and detected_lang in group["languages"] and detected_qual in group["languages"][detected_lang]:
-            file = group["languages"][detected_lang][detected_qual]
-            msg_text = f"Found '{group_name} ({detected_lang} - {detected_qual})'! Generating your link..."
-            await bot_app.send_message(chat_id, msg_text)
-            await send_ad_link(chat_id, {"fileId": file["fileId"], "fileName": file["fileName"], "groupName": group_name, "lang": detected_lang, "quality": detected_qual})
-            continue
+    @staticmethod
+    def make_key(query, lang, quality):
+        return (normalize_query(query), lang or "", quality or "")
 
-        # Case 2: "jawan 4k" - Lang missing
-        if not detected_lang and detected_qual:
-            langs_with_quality = [lang for lang in available_languages if detected_qual in group["languages"][lang]]
-            if len(langs_with_quality) == 1:
-                lang = langs_with_quality[0]
-                file = group["languages"][lang][detected_qual]
-                msg_text = f"Found '{group_name} ({lang} - {detected_qual})'! Generating your link..."
-                await bot_app.send_message(chat_id, msg_text)
-                await send_ad_link(chat_id, {"fileId": file["fileId"], "fileName": file["fileName"], "groupName": group_name, "lang": lang, "quality": detected_qual})
-                continue
-            elif len(langs_with_quality) > 1:
-                buttons = [InlineKeyboardButton(lang, callback_data=f"lang_{group_id}_{lang}") for lang in langs_with_quality]
-                await bot_app.send_message(chat_id, f"I found '{group_name}' in {detected_qual}. Which language?", reply_markup=InlineKeyboardMarkup([buttons]))
-                continue
+    def get(self, key):
+        entry = self.entries.get(key)
+        if not entry: return None
+        if entry["expiresAt"] <= time.monotonic():
+            del self.entries[key]
+            return None
+        self.entries.move_to_end(key)
+        return entry
 
-        # Case 3: "jawan hindi" - Quality missing
-        if detected_lang and not detected_qual and detected_lang in group["languages"]:
-            await ask_for_quality(chat_id, None, group, detected_lang)
-            continue
-            
-        # Case 4: "jawan" - Both missing
-        if len(available_languages) == 1:
-            await ask_for_quality(chat_id, None, group, available_languages[0])
-        else:
-            buttons = [InlineKeyboardButton(lang, callback_data=f"lang_{group_id}_{lang}") for lang in available_languages]
-            keyboard_rows = [buttons[i:i + 3] for i in range(0, len(buttons), 3)]
+    def put(self, key, group_ids, notice=None):
+        entry = {"groupIds": group_ids, "notice": notice, "expiresAt": time.monotonic() + self.ttl}
+        self.entries[key] = entry
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+        return entry
+
+result_cache = ResultCache()
+
+# All results go into one message, RESULTS_PAGE_SIZE groups per page, with a
+# button per group and Prev/Next buttons that edit the message in place. A single
+# matching group skips the list and goes straight to its language/quality step.
+async def handle_search_results(chat_id, cache_key, entry, message=None, page=0):
+    query, detected_lang, detected_qual = cache_key
+    groups = [(group_id, files_store.get(group_id)) for group_id in entry["groupIds"]]
+    groups = [(group_id, group) for group_id, group in groups if group and group["languages"]]
+    if not groups:
+        await bot_app.send_message(chat_id, f"Sorry, the results for '{query}' are no longer available. Please search again.")
+        return
+
+    if len(groups) == 1 and message is None:
+        if entry["notice"]:
+            await bot_app.send_message(chat_id, f"{entry['notice']} Showing results:")
+        await open_group(chat_id, groups[0][0], groups[0][1], detected_lang or None, detected_qual or None)
+        return
+
+    pages = math.ceil(len(groups) / RESULTS_PAGE_SIZE)
+    page = max(0, min(page, pages - 1))
+    first = page * RESULTS_PAGE_SIZE
+    lines = [f"{entry['notice']} Showing results:" if entry["notice"] else f"Results for '{query}':", ""]
+    rows = []
+    for n, (group_id, group) in enumerate(groups[first:first + RESULTS_PAGE_SIZE], start=first + 1):
+        lines.append(f"{n}. {group['groupName']} ({', '.join(group['languages'])})")
+        rows.append([InlineKeyboardButton(f"{n}. {group['groupName']}"[:60], callback_data=callback_tokens.issue("pick", group_id, detected_lang, detected_qual))])
+    if pages > 1:
+        lines.append(f"\nPage {page + 1} / {pages}")
+        nav = []
+        if page > 0:
+            nav.append(InlineKeyboardButton("◀ Prev", callback_data=callback_tokens.issue("page", *cache_key, page - 1)))
+        if page < pages - 1:
+            nav.append(InlineKeyboardButton("Next ▶", callback_data=callback_tokens.issue("page", *cache_key, page + 1)))
+        rows.append(nav)
+
+    text, keyboard = "\n".join(lines), InlineKeyboardMarkup(rows)
+    if message:
+        await message.edit_text(text, reply_markup=keyboard)
+    else:
+        await bot_app.send_message(chat_id, text, reply_markup=keyboard)
+
+# Next step for one group, using whatever language/quality the query named
+async def open_group(chat_id, group_id, group, detected_lang, detected_qual):
+    group_name = group["groupName"]
+    available_languages = list(group["languages"].keys())
+
+    # Case 1: "jawan hindi 4k" - Perfect match
+    if detected_lang and detected_qual and detected_lang in group["languages"] and detected_qual in group["languages"][detected_lang]:
+        file = group["languages"][detected_lang][detected_qual]
+        msg_text = f"Found '{group_name} ({detected_lang} - {detected_qual})'! Generating your link..."
+        await bot_app.send_message(chat_id, msg_text)
+        await send_ad_link(chat_id, {"fileId": file["fileId"], "fileName": file["fileName"], "groupName": group_name, "lang": detected_lang, "quality": detected_qual})
+        return
+
+    # Case 2: "jawan 4k" - Lang missing
+    if not detected_lang and detected_qual:
+        langs_with_quality = [lang for lang in available_languages if detected_qual in group["languages"][lang]]
+        if len(langs_with_quality) == 1:
+            lang = langs_with_quality[0]
+            file = group["languages"][lang][detected_qual]
+            msg_text = f"Found '{group_name} ({lang} - {detected_qual})'! Generating your link..."
+            await bot_app.send_message(chat_id, msg_text)
+            await send_ad_link(chat_id, {"fileId": file["fileId"], "fileName": file["fileName"], "groupName": group_name, "lang": lang, "quality": detected_qual})
+            return
+        elif len(langs_with_quality) > 1:
+            buttons = [InlineKeyboardButton(lang, callback_data=callback_tokens.issue("lang", group_id, lang)) for lang in langs_with_quality]
+            await bot_app.send_message(chat_id, f"I found '{group_name}' in {detected_qual}. Which language?", reply_markup=InlineKeyboardMarkup([buttons]))
+            return
+
+    # Case 3: "jawan hindi" - Quality missing
+    if detected_lang and not detected_qual and detected_lang in group["languages"]:
+        await ask_for_quality(chat_id, None, group, detected_lang)
+        return
+        
+    # Case 4: "jawan" - Both missing
+    if len(available_languages) == 1:
+        await ask_for_quality(chat_id, None, group, available_languages[0])
+    else:
+        buttons = [InlineKeyboardButton(lang, callback_data=callback_tokens.issue("lang", group_id, lang)) for lang in available_languages]
+        keyboard_rows = [buttons[i:i + 3] for i in range(0, len(buttons), 3)]
+        await bot_app.send_message(chat_id, f"I found '{group_name}'. Which language do you need?", reply_markup=InlineKeyboardMarkup(keyboard_rows))
 # --- FILE 1: bot.py (Part 3 of 3) ---
 # --- Copy this part last. ---
 
@@ -417,38 +2547,49 @@ async def handle_search_results(chat_id, results, detected_lang, detected_qual):
 async def handle_callback_query(client: Client, query: CallbackQuery):
     chat_id = query.message.chat.id
     user_id = query.from_user.id
-    data = query.data
+    payload = callback_tokens.resolve(query.data)
 
     try:
-        if data.startswith("lang_") or data.startswith("qual_"):
+        if payload is None:
+            # Issued before a restart, or evicted from the table
+            await query.answer("This button has expired. Please search again.", show_alert=True)
+            return
+
+        if payload[0] in ("lang", "qual"):
             await query.answer()
-            db = await load_db(DB_PATH_FILES)
-            parts = data.split('_')
-            type, group_id = parts[0], parts[1]
-            group = db.get(group_id)
+            group_id, lang = payload[1], payload[2]
+            group = files_store.get(group_id)
             if not group: raise Exception(f"Group not found: {group_id}")
 
-            if type == "lang":
-                lang = parts[2]
+            if payload[0] == "lang":
                 await ask_for_quality(chat_id, query.message, group, lang)
             
-            elif type == "qual":
-                lang, quality = parts[2], parts[3]
+            else:
+                quality = payload[3]
                 file = group["languages"][lang][quality]
                 await query.message.reply_text(f"Generating link for '{group['groupName']} ({lang} - {quality})'...")
                 await send_ad_link(chat_id, {"fileId": file["fileId"], "fileName": file["fileName"], "groupName": group["groupName"], "lang": lang, "quality": quality})
                 await query.message.edit_reply_markup(None) # Remove buttons
 
-        elif data.startswith("request_"):
-            query_to_request = data.split("_", 1)[1]
-            requests_db = await load_db(DB_PATH_REQUESTS)
-            
-            if query_to_request not in requests_db:
-                requests_db[query_to_request] = []
-            
-            if user_id not in requests_db[query_to_request]:
-                requests_db[query_to_request].append(user_id)
-                await save_db(DB_PATH_REQUESTS, requests_db)
+        elif payload[0] == "pick":
+            await query.answer()
+            group_id, detected_lang, detected_qual = payload[1], payload[2], payload[3]
+            group = files_store.get(group_id)
+            if not group: raise Exception(f"Group not found: {group_id}")
+            await open_group(chat_id, group_id, group, detected_lang or None, detected_qual or None)
+
+        elif payload[0] == "page":
+            cache_key, page = tuple(payload[1:4]), payload[4]
+            entry = result_cache.get(cache_key)
+            if not entry:
+                await query.answer("These results have expired. Please search again.", show_alert=True)
+                return
+            await query.answer()
+            await handle_search_results(chat_id, cache_key, entry, query.message, page)
+
+        elif payload[0] == "request":
+            query_to_request = payload[1]
+            if request_registry.add(query_to_request, user_id):
                 await query.answer("Request added!", show_alert=False)
                 await query.message.edit_text(f"Great! I've added '{query_to_request}' to the admin's request list. **You will be notified when it's available.**", parse_mode=enums.ParseMode.MARKDOWN)
                 logger.info(f"New Request: '{query_to_request}' from user {user_id}")
@@ -467,7 +2608,7 @@ async def ask_for_quality(chat_id, original_message: Message, group, lang):
         return
         
     qualities = list(group["languages"][lang].keys())
-    group_id = group["groupName"].lower().replace(r'[^a-z0-9]', '_').replace('__', '_')
+    group_id = make_group_id(group["groupName"])
     
     if len(qualities) == 1:
         quality = qualities[0]
@@ -481,7 +2622,7 @@ async def ask_for_quality(chat_id, original_message: Message, group, lang):
         await send_ad_link(chat_id, {"fileId": file["fileId"], "fileName": file["fileName"], "groupName": group["groupName"], "lang": lang, "quality": quality})
     
     else:
-        buttons = [InlineKeyboardButton(qual, callback_data=f"qual_{group_id}_{lang}_{qual}") for qual in qualities]
+        buttons = [InlineKeyboardButton(qual, callback_data=callback_tokens.issue("qual", group_id, lang, qual)) for qual in qualities]
         keyboard = InlineKeyboardMarkup([buttons])
         msg_text = f"You selected {lang}. Now, which quality do you need?"
         
@@ -491,6 +2632,90 @@ async def ask_for_quality(chat_id, original_message: Message, group, lang):
             await bot_app.send_message(chat_id, f"I found '{group['groupName']} ({lang})'. Which quality do you need?", reply_markup=keyboard)
 
 # --- 6f. "SEND AD LINK" HELPER ---
+# Download links from the user account are reused for LINK_CACHE_TTL, concurrent
+# requests for one file share a single lookup, and links for the most clicked
+# files are refreshed in the background before they expire. This keeps MTProto
+# round-trips (and FloodWait risk) on the scraping account to a minimum.
+class DownloadLinkCache:
+    def __init__(self):
+        self.entries = OrderedDict() # fileId -> (expires_at, link)
+        self.inflight = {}
+        self.stats = {"hits": 0, "misses": 0, "coalesced": 0, "prefetched": 0}
+        self._task = None
+
+    def _fresh(self, file_id, margin=0):
+        entry = self.entries.get(file_id)
+        return entry if entry and entry[0] - margin > time.time() else None
+
+    async def get(self, file_id):
+        entry = self._fresh(file_id)
+        if entry:
+            self.entries.move_to_end(file_id)
+            self.stats["hits"] += 1
+            return entry[1]
+        if file_id in self.inflight:
+            self.stats["coalesced"] += 1
+        else:
+            self.stats["misses"] += 1
+            self.inflight[file_id] = asyncio.create_task(self._fetch(file_id))
+        return await asyncio.shield(self.inflight[file_id])
+
+    async def _fetch(self, file_id):
+        started = time.perf_counter()
+        result = "error"
+        try:
+            # Use the User Account to generate the file link, as it's more reliable
+            client = await ensure_user_app()
+            link = await client.get_download_link(file_id)
+            result = "ok"
+            self.entries[file_id] = (time.time() + LINK_CACHE_TTL, link)
+            self.entries.move_to_end(file_id)
+            while len(self.entries) > LINK_CACHE_MAX_ENTRIES:
+                self.entries.popitem(last=False)
+            return link
+        finally:
+            metrics.observe("download_link_seconds", time.perf_counter() - started, result=result)
+            del self.inflight[file_id]
+
+    def popular_file_ids(self):
+        file_ids = []
+        for item in heapq.nlargest(LINK_PREFETCH_TOP_N, popularity_store.values(), key=lambda item: item["count"]):
+            group = files_store.get(make_group_id(item["groupName"]))
+            file = group and group["languages"].get(item["lang"], {}).get(item["quality"])
+            if file:
+                file_ids.append(file["fileId"])
+        return file_ids
+
+    def start(self):
+        if LINK_PREFETCH_TOP_N and not self._task:
+            self._task = asyncio.create_task(self._prefetch_loop())
+
+    async def _prefetch_loop(self):
+        while True:
+            for file_id in self.popular_file_ids():
+                # Refresh anything that would expire before the next round
+                if self._fresh(file_id, margin=LINK_PREFETCH_INTERVAL) or file_id in self.inflight:
+                    continue
+                try:
+                    self.inflight[file_id] = asyncio.create_task(self._fetch(file_id))
+                    await asyncio.shield(self.inflight[file_id])
+                    self.stats["prefetched"] += 1
+                except FloodWait as e:
+                    record_flood_wait("link_prefetch", e)
+                    logger.warning(f"Link prefetch: FloodWait, sleeping for {e.value} seconds.")
+                    await asyncio.sleep(e.value)
+                except Exception as e:
+                    logger.warning(f"Link prefetch failed for {file_id}: {e}")
+                await asyncio.sleep(LINK_PREFETCH_SPACING)
+            await asyncio.sleep(LINK_PREFETCH_INTERVAL)
+
+    def close(self):
+        if self._task:
+            self._task.cancel()
+            self._task = None
+
+link_cache = DownloadLinkCache()
+
 async def send_ad_link(chat_id, file_data):
     if "YOUR_BLOG" in YOUR_BLOGGER_AD_PAGE_URL:
         await bot_app.send_message(chat_id, "Bot is not configured. Admin needs to set the Blogger URL.")
@@ -498,13 +2723,13 @@ async def send_ad_link(chat_id, file_data):
         return
     
     try:
-        # Use the User Account to generate the file link, as it's more reliable
-        long_link = await user_app.get_download_link(file_data["fileId"])
+        long_link = await link_cache.get(file_data["fileId"])
         encoded_link = aiohttp.helpers.quote(long_link)
         ad_page_link = f"{YOUR_BLOGGER_AD_PAGE_URL}?dest={encoded_link}"
         reply_message = f"File: {file_data['fileName']}\nLink: {ad_page_link}"
         
-        await bot_app.send_message(chat_id, reply_message, disable_web_page_preview=True)
+        with metrics.timer("telegram_send_seconds", kind="link"):
+            await bot_app.send_message(chat_id, reply_message, disable_web_page_preview=True)
         await track_popularity(file_data) # Track this click
         
     except Exception as e:
@@ -521,77 +2746,267 @@ async def handle_myid(client: Client, message: Message):
 
 @bot_app.on_message(filters.command("requests") & filters.user(int(ADMIN_CHAT_ID)) & filters.private)
 async def handle_requests(client: Client, message: Message):
-    requests_db = await load_db(DB_PATH_REQUESTS)
-    if not requests_db:
+    if not len(request_registry):
         await message.reply("The request list is currently empty.")
         return
     
-    request_counts = {title: len(user_ids) for title, user_ids in requests_db.items()}
-    sorted_requests = sorted(request_counts.items(), key=lambda item: item[1], reverse=True)
-    
     reply_message = "🏆 Top 20 Movie Requests:\n\n"
-    for i, (title, count) in enumerate(sorted_requests[:20]):
+    for i, (title, count) in enumerate(request_registry.top(20)):
         reply_message += f"{i + 1}. `{title}` ({count} requests)\n"
     
     await message.reply(reply_message, parse_mode=enums.ParseMode.MARKDOWN)
 
 @bot_app.on_message(filters.command("clearrequests") & filters.user(int(ADMIN_CHAT_ID)) & filters.private)
 async def handle_clear_requests(client: Client, message: Message):
-    await save_db(DB_PATH_REQUESTS, {})
+    request_registry.clear()
     await message.reply("✅ The movie request list has been cleared.")
 
 @bot_app.on_message(filters.command("popularity") & filters.user(int(ADMIN_CHAT_ID)) & filters.private)
 async def handle_popularity(client: Client, message: Message):
-    pop_db = await load_db(DB_PATH_POPULARITY)
-    if not pop_db:
+    popularity_tracker.flush()
+    if not len(popularity_store):
         await message.reply("No popularity data recorded yet.")
         return
         
-    sorted_list = sorted(pop_db.values(), key=lambda item: item["count"], reverse=True)
+    sorted_list = heapq.nlargest(20, popularity_store.values(), key=lambda item: item["count"])
     
     reply_message = "🔥 Top 20 Most Popular Files:\n\n"
-    for i, item in enumerate(sorted_list[:20]):
+    for i, item in enumerate(sorted_list):
         reply_message += f"{i + 1}. `{item['groupName']} ({item['lang']} / {item['quality']})` - {item['count']} Clicks\n"
+
+    for window, title in (("lastHour", "Last Hour"), ("lastDay", "Last 24 Hours")):
+        trending = popularity_tracker.trending(window, 5)
+        if trending:
+            reply_message += f"\n📈 Trending ({title}):\n"
+            for i, item in enumerate(trending):
+                reply_message += f"{i + 1}. `{item['groupName']} ({item['lang']} / {item['quality']})` - {item['count']} Clicks\n"
     
     await message.reply(reply_message, parse_mode=enums.ParseMode.MARKDOWN)
 
+# --- Broadcast Engine ---
+# Token bucket for the bot's global send rate plus a minimum gap per chat.
+# A FloodWait pauses the whole bucket, since Telegram applies it bot-wide.
+class SendRateLimiter:
+    def __init__(self, rate, burst, per_chat_interval):
+        self.rate = rate
+        self.burst = burst
+        self.per_chat_interval = per_chat_interval
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.paused_until = 0
+        self.chat_next = {} # chat_id -> earliest monotonic time for its next message
+
+    async def acquire(self, chat_id):
+        while True:
+            now = time.monotonic()
+            wait = max(self.paused_until, self.chat_next.get(chat_id, 0)) - now
+            if wait <= 0:
+                self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    self.chat_next[chat_id] = now + self.per_chat_interval
+                    if len(self.chat_next) > 10000:
+                        self.chat_next = {chat: at for chat, at in self.chat_next.items() if at > now}
+                    return
+                wait = (1 - self.tokens) / self.rate
+            await asyncio.sleep(wait)
+
+    def pause(self, seconds):
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+        self.tokens = 0
+
+send_limiter = SendRateLimiter(BROADCAST_GLOBAL_RATE, BROADCAST_BURST, BROADCAST_PER_CHAT_INTERVAL)
+
+# One notification run for a requested title. Recipients are fanned out to
+# BROADCAST_CONCURRENCY senders that share send_limiter. Delivered/failed users
+# are checkpointed in broadcasts_store, so an interrupted run resumes with only
+# the users still waiting (at most BROADCAST_CHECKPOINT_EVERY may be re-sent).
+# The recipient list is stored once under the title; each checkpoint adds a
+# "<title>\tprogress\t<n>" entry holding just the users settled since the last.
+# Titles in Broadcast.active are being sent right now and are never resumed twice.
+class Broadcast:
+    active = set()
+
+    def __init__(self, state, status_msg):
+        self.title = state["title"]
+        self.text = state["text"]
+        self.recipients = state["recipients"]
+        self.delivered = set()
+        self.failed = set()
+        self._chunks = 0
+        while (chunk := broadcasts_store.get(self.progress_key(self.title, self._chunks))) is not None:
+            self.delivered.update(chunk["delivered"])
+            self.failed.update(chunk["failed"])
+            self._chunks += 1
+        self._new_delivered = []
+        self._new_failed = []
+        self.status_msg = status_msg
+        self.flood_waits = 0
+        self._unsaved = 0
+
+    @staticmethod
+    def progress_key(title, n):
+        return f"{title}\tprogress\t{n}"
+
+    @classmethod
+    def create(cls, title, user_ids, status_msg):
+        text = f"Good news! The movie you requested, '{title}', is now available.\n\nSend '{title}' to the bot to get your link!"
+        state = {"title": title, "text": text, "recipients": list(dict.fromkeys(user_ids)), "status": "running", "startedAt": int(time.time())}
+        n = 0
+        while cls.progress_key(title, n) in broadcasts_store: # Left over from an earlier run of this title
+            broadcasts_store.delete(cls.progress_key(title, n))
+            n += 1
+        broadcasts_store.set(title, state)
+        return cls(state, status_msg)
+
+    def mark(self, user_id, delivered):
+        (self.delivered if delivered else self.failed).add(user_id)
+        (self._new_delivered if delivered else self._new_failed).append(user_id)
+
+    def checkpoint(self, done=False):
+        if self._new_delivered or self._new_failed:
+            broadcasts_store.set(self.progress_key(self.title, self._chunks), {"delivered": self._new_delivered, "failed": self._new_failed})
+            self._chunks += 1
+            self._new_delivered, self._new_failed = [], []
+        if done:
+            broadcasts_store.set(self.title, {**broadcasts_store.get(self.title, {}), "status": "done"})
+        self._unsaved = 0
+
+    def discard(self):
+        for n in range(self._chunks):
+            broadcasts_store.delete(self.progress_key(self.title, n))
+        broadcasts_store.delete(self.title)
+
+    def progress_text(self):
+        return f"Broadcasting '{self.title}'...\nSent: {len(self.delivered)} / {len(self.recipients)}\nFailed: {len(self.failed)}\nFloodWaits: {self.flood_waits}"
+
+    async def run(self):
+        queue = asyncio.Queue()
+        for user_id in self.recipients:
+            if user_id not in self.delivered and user_id not in self.failed:
+                queue.put_nowait((user_id, 0))
+        senders = [asyncio.create_task(self._sender(queue)) for _ in range(BROADCAST_CONCURRENCY)]
+        progress = asyncio.create_task(self._report_progress())
+        try:
+            await queue.join()
+        finally:
+            for task in senders + [progress]:
+                task.cancel()
+            self.checkpoint(done=queue.empty())
+
+    async def _sender(self, queue):
+        while True:
+            user_id, attempts = await queue.get()
+            try:
+                await send_limiter.acquire(user_id)
+                started = time.perf_counter()
+                await bot_app.send_message(user_id, self.text)
+                metrics.observe("telegram_send_seconds", time.perf_counter() - started, kind="broadcast", result="ok")
+                self.mark(user_id, True)
+            except FloodWait as e:
+                # Everyone backs off, and this user goes back in line
+                self.flood_waits += 1
+                record_flood_wait("broadcast", e)
+                logger.warning(f"Broadcast: FloodWait, pausing all senders for {e.value} seconds.")
+                send_limiter.pause(e.value)
+                queue.put_nowait((user_id, attempts))
+            except RPCError as e:
+                # Blocked the bot, deactivated, etc. Retrying won't help.
+                logger.warning(f"Failed to send broadcast to user {user_id}: {e}")
+                self.mark(user_id, False)
+            except Exception as e:
+                if attempts + 1 < BROADCAST_MAX_ATTEMPTS:
+                    queue.put_nowait((user_id, attempts + 1))
+                else:
+                    logger.warning(f"Failed to send broadcast to user {user_id}: {e}")
+                    self.mark(user_id, False)
+            finally:
+                queue.task_done()
+
+            self._unsaved += 1
+            if self._unsaved >= BROADCAST_CHECKPOINT_EVERY:
+                self.checkpoint()
+
+    async def _report_progress(self):
+        last_text = None
+        while True:
+            await asyncio.sleep(BROADCAST_PROGRESS_INTERVAL)
+            text = self.progress_text()
+            if text == last_text: continue
+            try:
+                await self.status_msg.edit(text)
+                last_text = text
+            except Exception as e:
+                logger.warning(f"Broadcast: Could not update progress message: {e}")
+
+# Claims the title before the first await, so two resumes can't both start it.
+# announce() sends the status message; make(status_msg) builds the Broadcast.
+async def start_broadcast(title, announce, make):
+    if title in Broadcast.active: return False
+    Broadcast.active.add(title)
+    try:
+        status_msg = await announce()
+        await run_broadcast(make(status_msg))
+    finally:
+        Broadcast.active.discard(title)
+    return True
+
+async def run_broadcast(broadcast):
+    try:
+        await broadcast.run()
+    except Exception as e:
+        logger.error(f"Error during broadcast of '{broadcast.title}': {e}")
+        await broadcast.status_msg.edit(f"Broadcast interrupted: {e}\n\nProgress is saved. Send `/broadcast resume` to continue.")
+        return
+
+    request_registry.remove(broadcast.title)
+    broadcast.discard()
+    await broadcast.status_msg.edit(f"Broadcast complete!\nMessage sent to {len(broadcast.delivered)} / {len(broadcast.recipients)} users.\nRequest for '{broadcast.title}' has been cleared.")
+
+# Saved runs that nobody is sending right now (progress entries have no recipients)
+def unfinished_broadcasts():
+    return [state for state in list(broadcasts_store.values())
+            if "recipients" in state and state.get("status") != "done" and state["title"] not in Broadcast.active]
+
 @bot_app.on_message(filters.command("broadcast") & filters.user(int(ADMIN_CHAT_ID)) & filters.private)
 async def handle_broadcast(client: Client, message: Message):
     try:
         admin_query = message.text.split(" ", 1)[1].lower()
     except IndexError:
-        await message.reply("Usage: `/broadcast [Movie Title]`")
+        await message.reply("Usage: `/broadcast [Movie Title]`\nOr `/broadcast resume` to continue interrupted broadcasts.")
         return
 
-    requests_db = await load_db(DB_PATH_REQUESTS)
-    target_title = None
-    target_user_ids = []
-    
-    for title, user_ids in requests_db.items():
-        if title.lower() == admin_query:
-            target_title = title
-            target_user_ids = user_ids
-            break
-            
+    if admin_query == "resume":
+        states = unfinished_broadcasts()
+        if not states:
+            await message.reply("There are no interrupted broadcasts." + (" (Running now: " + ", ".join(sorted(Broadcast.active)) + ")" if Broadcast.active else ""))
+            return
+        for state in states:
+            await start_broadcast(state["title"], lambda: message.reply(f"Resuming broadcast for '{state['title']}'..."),
+                                  lambda status_msg: Broadcast(state, status_msg))
+        return
+
+    target_title, target_user_ids = request_registry.find(admin_query)
     if not target_title:
         await message.reply(f"Error: Could not find '{admin_query}' in the request list.")
         return
 
-    await message.reply(f"Starting broadcast for '{target_title}' to {len(target_user_ids)} users...")
-    success_count = 0
-    
-    for user_id in target_user_ids:
-        try:
-            await bot_app.send_message(user_id, f"Good news! The movie you requested, '{target_title}', is now available.\n\nSend '{target_title}' to the bot to get your link!")
-            success_count += 1
-            await asyncio.sleep(0.1) # 100ms delay for rate limit
-        except Exception as e:
-            logger.warning(f"Failed to send broadcast to user {user_id}: {e}")
-            
-    del requests_db[target_title]
-    await save_db(DB_PATH_REQUESTS, requests_db)
-    
-    await message.reply(f"Broadcast complete!\nMessage sent to {success_count} / {len(target_user_ids)} users.\nRequest for '{target_title}' has been cleared.")
+    if target_title in Broadcast.active:
+        await message.reply(f"A broadcast for '{target_title}' is already running.")
+        return
+    if broadcasts_store.get(target_title, {}).get("status") == "running":
+        await message.reply(f"A broadcast for '{target_title}' is already saved. Send `/broadcast resume` to continue it.")
+        return
+
+    await start_broadcast(target_title, lambda: message.reply(f"Starting broadcast for '{target_title}' to {len(target_user_ids)} users..."),
+                          lambda status_msg: Broadcast.create(target_title, sorted(target_user_ids), status_msg))
+
+# Called once at startup: picks up broadcasts that a crash or restart cut short
+async def resume_broadcasts():
+    for state in unfinished_broadcasts():
+        await start_broadcast(state["title"], lambda: bot_app.send_message(int(ADMIN_CHAT_ID), f"Resuming interrupted broadcast for '{state['title']}'..."),
+                              lambda status_msg: Broadcast(state, status_msg))
 
 @bot_app.on_message(filters.command("admin") & filters.user(int(ADMIN_CHAT_ID)) & filters.private)
 async def handle_admin(client: Client, message: Message):
@@ -603,34 +3018,375 @@ async def handle_admin(client: Client, message: Message):
     await message.reply("Welcome, Admin. Here is your dashboard link:", reply_markup=keyboard)
 
 # -----------------------------------------------------------------
-# --- 8. FLASK WEB SERVER (For Admin Dashboard API) ---
+# --- 8. WEB SERVER (For Admin Dashboard API) ---
 # -----------------------------------------------------------------
 
-flask_app = Flask(__name__)
+# Served by aiohttp on the bot's own event loop, so it reads the resident stores
+# directly. Request counts come from request_registry and click totals are kept
+# up to date through popularity_store's change hook; the JSON body is rebuilt at most every
+# DASHBOARD_CACHE_TTL seconds and carries an ETag, so polling costs O(1).
+class DashboardStats:
+    def __init__(self):
+        self.click_counts = {}    # popularity key -> all-time clicks
+        self.total_clicks = 0
+        self._body = None
+        self._etag = None
+        self._built_at = 0
+        self.built = False # Counted on the first dashboard request, not at startup
 
-@flask_app.route('/api/dashboard_data', methods=['GET'])
-async def get_dashboard_data():
-    if request.args.get('secret') != API_SECRET_KEY:
-        abort(403, description="Forbidden: Invalid API Secret")
-    
+    def rebuild(self):
+        self.click_counts = {key: item["count"] for key, item in popularity_store.items()}
+        self.total_clicks = sum(self.click_counts.values())
+        self._body = None
+        self.built = True
+
+    def on_popularity_change(self, op):
+        if not self.built: return
+        if op[0] == "s":
+            self.total_clicks += op[2]["count"] - self.click_counts.get(op[1], 0)
+            self.click_counts[op[1]] = op[2]["count"]
+        elif op[0] == "d":
+            self.total_clicks -= self.click_counts.pop(op[1], 0)
+        elif op[0] == "c":
+            self.click_counts = {}
+            self.total_clicks = 0
+
+    def response_body(self):
+        if not self.built:
+            self.rebuild()
+        if self._body is None or time.monotonic() - self._built_at >= DASHBOARD_CACHE_TTL:
+            top_requests = request_registry.top(20)
+            top_popular = heapq.nlargest(20, self.click_counts.items(), key=lambda item: item[1])
+            data = {
+                "topRequests": [{"title": title, "count": count} for title, count in top_requests],
+                "topPopular": [{field: popularity_store.get(key)[field] for field in ("groupName", "lang", "quality", "count")} for key, count in top_popular],
+                "totalFiles": len(files_store),
+                "totalRequests": len(request_registry),
+                "totalClicks": self.total_clicks,
+                "trending": {window: popularity_tracker.trending(window) for window in POPULARITY_WINDOWS},
+                "aiCache": dict(gemini_cache.stats),
+                "linkCache": dict(link_cache.stats)
+            }
+            self._body = json.dumps(data).encode('utf-8')
+            self._etag = '"' + hashlib.sha1(self._body).hexdigest() + '"'
+            self._built_at = time.monotonic()
+        return self._body, self._etag
+
+dashboard_stats = DashboardStats()
+popularity_store.watch(dashboard_stats.on_popularity_change)
+
+def check_api_secret(request):
+    if request.query.get('secret') != API_SECRET_KEY:
+        raise web.HTTPForbidden(text="Forbidden: Invalid API Secret")
+
+async def get_dashboard_data(request):
+    check_api_secret(request)
     try:
-        requests_db = await load_db(DB_PATH_REQUESTS)
-        popularity_db = await load_db(DB_PATH_POPULARITY)
-        files_db = await load_db(DB_PATH_FILES)
-        
-        request_counts = {title: len(user_ids) for title, user_ids in requests_db.items()}
-        sorted_requests = sorted(request_counts.items(), key=lambda item: item[1], reverse=True)
-        
-        pop_list = sorted(popularity_db.values(), key=lambda item: item["count"], reverse=True)
-        
-        return jsonify({
-            "topRequests": [{"title": title, "count": count} for title, count in sorted_requests[:20]],
-            "topPopular": pop_list[:20],
-            "totalFiles": len(files_db),
-            "totalRequests": len(requests_db),
-            "totalClicks": sum(item["count"] for item in pop_list)
-        })
+        body, etag = dashboard_stats.response_body()
     except Exception as e:
         logger.error(f"Error in /api/dashboard_data: {e}")
-        abort(500, description="Internal
-            await bot_app.send_message(chat_id, f"I found '{group_name}'. Which language do you need?", reply_markup=InlineKeyboardMarkup(keyboard_rows))
\ No newline at end of file
+        raise web.HTTPInternalServerError(text="Internal Server Error")
+
+    headers = {"ETag": etag, "Cache-Control": f"private, max-age={DASHBOARD_CACHE_TTL}"}
+    if request.headers.get("If-None-Match") == etag:
+        return web.Response(status=304, headers=headers)
+    return web.Response(body=body, content_type="application/json", headers=headers)
+
+# Scrape with e.g. `params: {secret: [...]}` in the Prometheus job config
+async def get_metrics(request):
+    check_api_secret(request)
+    return web.Response(text=metrics.render(), content_type="text/plain", charset="utf-8", headers={"Cache-Control": "no-store"})
+
+# --- Bulk export / import ---
+# GET /api/export/{files|requests|popularity} streams one JSON record per line:
+#   files      - a group as stored: {"groupName", "languages": {lang: {quality: file}}}
+#   requests   - {"title", "userId"}, one line per requester
+#   popularity - {"groupName", "lang", "quality", "count", "recent"}
+# Records are serialized EXPORT_CHUNK_LINES at a time from a snapshot of the keys,
+# so memory stays flat and a slow client only slows its own download.
+# POST /api/import/{name} reads the same format (files also accepts flat
+# {"groupName", "lang", "quality", "fileId", "fileName", "fileType"} rows) while
+# it is uploaded. Every record is validated and normalized like the indexer does
+# (group IDs, searchAll); every IMPORT_CHUNK_LINES records are committed and
+# journaled, which also yields so handlers keep running, and the store is
+# snapshotted once at the end. Bad lines are counted and
+# reported, not fatal. Imported files overwrite the same group/lang/quality slot,
+# popularity entries are replaced, and requests are added.
+IMPORT_FILE_TYPES = ("video", "document")
+
+def export_records(name):
+    if name == "files":
+        for group_id in list(files_store.data):
+            group = files_store.get(group_id)
+            if group is not None:
+                yield group
+    elif name == "requests":
+        for key in list(request_registry.requesters):
+            title = request_registry.titles.get(key)
+            for user_id in list(request_registry.requesters.get(key, ())):
+                yield {"title": title, "userId": user_id}
+    elif name == "popularity":
+        for key in list(popularity_store.data):
+            item = popularity_store.get(key)
+            if item is not None:
+                yield item
+
+def require_text(record, field):
+    value = record.get(field)
+    if not isinstance(value, str) or not value.strip():
+        raise ValueError(f"'{field}' must be a non-empty string")
+    return value.strip()
+
+def normalize_import_file(file):
+    if not isinstance(file, dict):
+        raise ValueError("file entries must be objects")
+    file_type = file.get("fileType", "document")
+    if file_type not in IMPORT_FILE_TYPES:
+        raise ValueError(f"'fileType' must be one of {', '.join(IMPORT_FILE_TYPES)}")
+    file_name = require_text(file, "fileName") if "fileName" in file else "Untitled"
+    normalized = {"fileId": require_text(file, "fileId"), "fileName": file_name, "fileType": file_type}
+    if file.get("fileUniqueId"): # Duplicate detection keys, when the source has them
+        normalized["fileUniqueId"] = require_text(file, "fileUniqueId")
+    for field in ("fileSize", "postedAt"):
+        if field in file:
+            if not isinstance(file[field], int) or isinstance(file[field], bool) or file[field] < 0:
+                raise ValueError(f"'{field}' must be a non-negative integer")
+            normalized[field] = file[field]
+    return normalized
+
+# -> (group_id, group name, [(lang, quality, file)])
+def normalize_import_group(record):
+    group_name = require_text(record, "groupName")
+    if "languages" not in record:
+        slots = [(require_text(record, "lang"), require_text(record, "quality"), normalize_import_file(record))]
+    elif isinstance(record["languages"], dict):
+        slots = []
+        for lang, qualities in record["languages"].items():
+            if not isinstance(qualities, dict):
+                raise ValueError(f"languages.{lang} must be an object")
+            for quality, file in qualities.items():
+                if not all(isinstance(name, str) and name.strip() for name in (lang, quality)):
+                    raise ValueError("language and quality names must be non-empty strings")
+                slots.append((lang, quality, normalize_import_file(file)))
+    else:
+        raise ValueError("'languages' must be an object")
+    return make_group_id(group_name), group_name, slots
+
+def import_records(name, records):
+    if name == "files":
+        groups = {}
+        for record in records:
+            group_id, group_name, slots = normalize_import_group(record)
+            group = groups.get(group_id)
+            if group is None:
+                existing = files_store.get(group_id)
+                group = copy.deepcopy(existing) if existing else {"groupName": group_name, "searchAll": normalize_query(group_name), "languages": {}}
+                groups[group_id] = group
+            for lang, quality, file in slots:
+                group["languages"].setdefault(lang, {})[quality] = file
+        for group_id, group in groups.items():
+            files_store.set(group_id, group)
+    elif name == "requests":
+        for title, user_id in records:
+            request_registry.add(title, user_id)
+    elif name == "popularity":
+        for key, item in records:
+            popularity_store.set(key, item)
+
+def validate_import_record(name, record):
+    if not isinstance(record, dict):
+        raise ValueError("record must be an object")
+    if name == "files":
+        normalize_import_group(record) # Normalized again, against the current group, when committed
+        return record
+    if name == "requests":
+        user_id = record.get("userId")
+        if not isinstance(user_id, int) or isinstance(user_id, bool):
+            raise ValueError("'userId' must be an integer")
+        return require_text(record, "title"), user_id
+    group_name, lang, quality = (require_text(record, field) for field in ("groupName", "lang", "quality"))
+    count = record.get("count")
+    if not isinstance(count, int) or isinstance(count, bool) or count < 0:
+        raise ValueError("'count' must be a non-negative integer")
+    recent = record.get("recent", {})
+    if not isinstance(recent, dict) or not all(str(bucket).isdigit() and isinstance(clicks, int) for bucket, clicks in recent.items()):
+        raise ValueError("'recent' must map bucket timestamps to click counts")
+    item = {"groupName": group_name, "lang": lang, "quality": quality, "count": count, "recent": {str(bucket): clicks for bucket, clicks in recent.items()}}
+    return popularity_key(group_name, lang, quality), item
+
+async def read_ndjson_lines(content):
+    buffer = b""
+    async for chunk in content.iter_chunked(65536):
+        buffer += chunk
+        *lines, buffer = buffer.split(b"\n")
+        if len(buffer) > IMPORT_MAX_LINE_BYTES:
+            raise web.HTTPRequestEntityTooLarge(max_size=IMPORT_MAX_LINE_BYTES, actual_size=len(buffer))
+        for line in lines:
+            yield line
+    yield buffer
+
+EXPORT_STORES = {store.name: store for store in (files_store, requests_store, popularity_store)}
+import_lock = asyncio.Lock()
+
+def store_name_of(request):
+    name = request.match_info["name"]
+    if name not in EXPORT_STORES:
+        raise web.HTTPNotFound(text=f"Unknown store '{name}'. Use one of: {', '.join(EXPORT_STORES)}")
+    return name
+
+async def get_export(request):
+    check_api_secret(request)
+    name = store_name_of(request)
+    response = web.StreamResponse(headers={"Content-Type": "application/x-ndjson", "Content-Disposition": f'attachment; filename="{name}.ndjson"', "Cache-Control": "no-store"})
+    response.enable_chunked_encoding()
+    await response.prepare(request)
+    lines = []
+    exported = 0
+    for record in export_records(name):
+        lines.append(json.dumps(record, ensure_ascii=False))
+        if len(lines) >= EXPORT_CHUNK_LINES:
+            exported += len(lines)
+            await response.write(("\n".join(lines) + "\n").encode('utf-8')) # Waits while the client catches up
+            lines = []
+    if lines:
+        exported += len(lines)
+        await response.write(("\n".join(lines) + "\n").encode('utf-8'))
+    await response.write_eof()
+    logger.info(f"Export: streamed {exported} {name} records")
+    return response
+
+async def post_import(request):
+    check_api_secret(request)
+    name = store_name_of(request)
+    if import_lock.locked():
+        raise web.HTTPConflict(text="Another import is already running.")
+    store = EXPORT_STORES[name]
+    async with import_lock:
+        if name == "popularity":
+            popularity_tracker.flush() # Unflushed clicks would otherwise overwrite imported counts
+        started = time.monotonic()
+        imported, skipped, errors, chunk = 0, 0, [], []
+        line_number = 0
+        store.bulk_loading = True # One snapshot at the end instead of one per STORE_DIRTY_THRESHOLD changes
+        try:
+            async for line in read_ndjson_lines(request.content):
+                line_number += 1
+                if not line.strip(): continue
+                try:
+                    chunk.append(validate_import_record(name, json.loads(line)))
+                except ValueError as e: # Includes malformed JSON
+                    skipped += 1
+                    if len(errors) < 20:
+                        errors.append({"line": line_number, "error": str(e)})
+                    continue
+                if len(chunk) >= IMPORT_CHUNK_LINES:
+                    import_records(name, chunk)
+                    imported += len(chunk)
+                    chunk = []
+                    await store.flush() # Journaled per chunk; also yields to handlers
+            import_records(name, chunk)
+            imported += len(chunk)
+        finally:
+            store.bulk_loading = False
+            await store.flush(force_snapshot=True)
+        if name == "popularity":
+            popularity_tracker.flush() # Clicks recorded while the import awaited the upload
+            popularity_tracker.load()
+
+    logger.info(f"Import: {imported} {name} records in {time.monotonic() - started:.2f}s ({skipped} skipped)")
+    return web.json_response({"store": name, "imported": imported, "skipped": skipped, "errors": errors})
+
+metrics.gauge("store_pending_ops", "Changes waiting to be written, per store", lambda: {(("store", store.name),): len(store._pending) for store in ALL_STORES})
+metrics.gauge("store_lock_busy", "1 while a store's I/O lock is held", lambda: {(("store", store.name),): int(store._io_lock.locked()) for store in ALL_STORES})
+metrics.gauge("store_keys", "Keys held in memory, per store", lambda: {(("store", store.name),): len(store) for store in ALL_STORES})
+metrics.gauge("scrape_queue_depth", "Batches waiting in the running /index pipeline", lambda: {(("queue", name),): queue.qsize() for name, queue in (ScrapeJob.active.queues.items() if ScrapeJob.active else ())})
+metrics.gauge("channel_batch_queue_depth", "Channel posts waiting to be indexed", lambda: sum(len(queue) for queue in admin_batch_queues.values()))
+metrics.gauge("popularity_pending_keys", "Files with clicks not yet flushed", lambda: len(popularity_tracker.pending))
+metrics.gauge("gemini_inflight", "Distinct Gemini calls in progress", lambda: len(gemini_cache.inflight))
+metrics.gauge("gemini_cache_events_total", "Gemini cache lookups, by outcome", lambda: {(("outcome", name),): count for name, count in gemini_cache.stats.items()}, kind="counter")
+metrics.gauge("download_link_inflight", "Download links being generated", lambda: len(link_cache.inflight))
+metrics.gauge("download_link_cache_events_total", "Download link cache lookups, by outcome", lambda: {(("outcome", name),): count for name, count in link_cache.stats.items()}, kind="counter")
+metrics.gauge("callback_tokens", "Button payloads held in the token table", lambda: len(callback_tokens.payloads))
+metrics.gauge("requests_titles", "Distinct requested titles", lambda: len(request_registry))
+metrics.gauge("searches_active", "User searches running", lambda: search_shedder.active)
+metrics.gauge("ai_fallback_slots", "AI search fallbacks running or queued", lambda: {(("state", "active"),): ai_fallback_shedder.active, (("state", "waiting"),): ai_fallback_shedder.waiting})
+metrics.gauge("searches_inflight_distinct", "Distinct searches being resolved (after coalescing)", lambda: len(search_flights.inflight))
+metrics.gauge("search_worker_processes", "Search worker processes (0 = searching in-process)", lambda: search_workers.processes if search_workers.enabled else 0)
+metrics.gauge("startup_seconds", "Seconds from process start to each startup phase", lambda: {(("phase", phase),): seconds for phase, seconds in startup_timings.items()})
+
+web_app = web.Application()
+web_app.router.add_get('/api/dashboard_data', get_dashboard_data)
+web_app.router.add_get('/metrics', get_metrics)
+web_app.router.add_get('/api/export/{name}', get_export)
+web_app.router.add_post('/api/import/{name}', post_import)
+
+# -----------------------------------------------------------------
+# --- 9. STARTUP & SHUTDOWN ---
+# -----------------------------------------------------------------
+
+# Only the stores (and any pending catalog migration) load before the bot starts
+# answering. The search and fuzzy indexes warm up in the background (searches
+# scan the catalog until then), the dashboard server starts right after the bot,
+# and the file-ID index, dashboard counters, HTTP session and user account
+# (get_download_link, /index) are set up on first use.
+async def warm_up_indexes():
+    if not isinstance(files_store.backend, SqliteBackend): # Searched through FTS5 there
+        await search_index.build_in_background()
+        mark_startup("searchIndexBuilt")
+    await fuzzy_matcher.build_in_background()
+    mark_startup("fuzzyIndexBuilt")
+
+async def main():
+    mark_startup("mainStarted")
+    for store in ALL_STORES:
+        store.load()
+        store.start()
+    mark_startup("storesLoaded")
+    migrate_catalog()
+    request_registry.load()
+    popularity_tracker.load()
+    popularity_tracker.start()
+    gc.freeze() # The loaded catalog lives forever; keep it out of future GC scans
+    mark_startup("catalogReady")
+    if SEARCH_WORKER_PROCESSES:
+        await files_store.flush() # Workers read the catalog from disk
+        search_workers.start()
+    else:
+        asyncio.create_task(warm_up_indexes())
+
+    await bot_app.start()
+    mark_startup("botStarted")
+    logger.info(f"Bot is running. Press Ctrl+C to stop. Startup timings (s): {startup_timings}")
+
+    web_runner = web.AppRunner(web_app, access_log=None)
+    await web_runner.setup()
+    await web.TCPSite(web_runner, SERVER_HOST, SERVER_PORT).start()
+    mark_startup("dashboardStarted")
+    logger.info(f"Dashboard API listening on {SERVER_HOST}:{SERVER_PORT}")
+
+    asyncio.create_task(resume_scrape_jobs())
+    asyncio.create_task(resume_broadcasts())
+    link_cache.start()
+
+    try:
+        await idle()
+    finally:
+        link_cache.close()
+        search_workers.close()
+        await web_runner.cleanup()
+        await bot_app.stop()
+        if user_app.is_connected:
+            await user_app.stop()
+        popularity_tracker.close()
+        for store in ALL_STORES:
+            await store.close()
+        await gemini_cache.close()
+        await http_client.close()
+        logger.info("All databases flushed. Bye!")
+
+if __name__ == "__main__":
+    writer_lock = acquire_writer_lock()
+    if sys.argv[1:] == ["migrate-sqlite"]:
+        migrate_json_to_sqlite()
+    else:
+        bot_app.run(main())
@@ -0,0 +1,30 @@
+import os
+import sys
+import tempfile
+
+import pytest
+
+# bot.py keeps its databases in the working directory; import it inside a scratch one
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.chdir(tempfile.mkdtemp(prefix="bot-tests-"))
+
+import bot  # noqa: E402
+
+
+@pytest.fixture
+def run():
+    # Everything runs on the bot's own loop, as it does in production
+    return bot.bot_app.loop.run_until_complete
+
+
+@pytest.fixture(autouse=True)
+def empty_stores():
+    for store in bot.ALL_STORES:
+        store.data.clear()
+        store._pending.clear()
+    for index in (bot.search_index, bot.fuzzy_matcher, bot.file_id_index):
+        index.__init__()
+        index.built = index.building = False
+    bot.request_registry.load()
+    yield
@@ -0,0 +1,48 @@
+import asyncio
+from types import SimpleNamespace
+
+import bot
+
+
+class FakeStatus:
+    async def edit(self, text):
+        return self
+
+
+def fake_sends(monkeypatch):
+    sent = []
+    async def send_message(chat_id, text, **kwargs):
+        await asyncio.sleep(0)
+        sent.append(chat_id)
+        return FakeStatus()
+    monkeypatch.setattr(bot.bot_app, "send_message", send_message)
+    monkeypatch.setattr(bot, "send_limiter", bot.SendRateLimiter(10**6, 10**6, 0))
+    return sent
+
+
+def test_concurrent_resumes_send_once(run, monkeypatch):
+    sent = fake_sends(monkeypatch)
+    bot.Broadcast.create("Jawan", list(range(1, 201)), FakeStatus())
+    message = SimpleNamespace(text="/broadcast resume", reply=lambda text: bot.bot_app.send_message(0, text))
+
+    async def go():
+        await asyncio.gather(bot.resume_broadcasts(), bot.handle_broadcast(None, message), bot.handle_broadcast(None, message))
+    run(go())
+    delivered = [chat_id for chat_id in sent if chat_id != int(bot.ADMIN_CHAT_ID) and chat_id != 0]
+    assert sorted(delivered) == list(range(1, 201))
+    assert not bot.broadcasts_store.data
+
+
+def test_checkpoints_journal_only_new_progress(run, monkeypatch):
+    fake_sends(monkeypatch)
+    broadcast = bot.Broadcast.create("Pathan", list(range(1, 1001)), FakeStatus())
+    bot.broadcasts_store._pending.clear()
+    run(broadcast.run())
+    ops = bot.broadcasts_store._pending
+    assert all(op[1] != "Pathan" for op in ops[:-1]) # Recipients are written once, at create and when done
+    assert max(len(op[2]["delivered"]) for op in ops if op[0] == "s" and "delivered" in op[2]) <= bot.BROADCAST_CHECKPOINT_EVERY
+
+    resumed = bot.Broadcast(bot.broadcasts_store.get("Pathan"), FakeStatus())
+    assert resumed.delivered == set(range(1, 1001))
+    resumed.discard()
+    assert not bot.broadcasts_store.data
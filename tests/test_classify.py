@@ -0,0 +1,36 @@
+import bot
+
+NAME = "some upload nobody can parse.mkv"
+
+
+def fake_gemini(monkeypatch, answers):
+    calls = []
+    async def call_gemini_uncached(prompt, schema=None, use_search=False):
+        calls.append(prompt)
+        return answers.pop(0)
+    monkeypatch.setattr(bot, "call_gemini_uncached", call_gemini_uncached)
+    return calls
+
+
+def test_invalid_answer_is_not_cached_as_a_hit(run, monkeypatch, tmp_path):
+    monkeypatch.setattr(bot, "gemini_cache", bot.GeminiCache(str(tmp_path / "cache.sqlite3")))
+    calls = fake_gemini(monkeypatch, [{"groupName": "", "lang": "Hindi", "quality": "720p"}])
+    assert run(bot.classify_file_names([NAME])) == [None]
+    assert run(bot.classify_file_names([NAME])) == [None] # Negative-cached, not committed
+    assert len(calls) == 1
+
+    bot.gemini_cache.entries.clear() # Failure expired
+    key = bot.GeminiCache.make_key(bot.file_info_prompt(NAME), bot.FILE_INFO_SCHEMA, False)
+    assert run(bot.gemini_cache.get(key)) == (False, None)
+
+
+def test_bad_cached_answer_is_asked_again(run, monkeypatch, tmp_path):
+    monkeypatch.setattr(bot, "gemini_cache", bot.GeminiCache(str(tmp_path / "cache.sqlite3")))
+    key = bot.GeminiCache.make_key(bot.file_info_prompt(NAME), bot.FILE_INFO_SCHEMA, False)
+    run(bot.gemini_cache.get(key)) # Opens the cache database
+    run(bot.gemini_cache.put(key, {"groupName": None, "lang": "Hindi", "quality": "720p"}, 3600)) # Stored by an older version
+    good = {"groupName": "Jawan", "lang": "Hindi", "quality": "720p"}
+    calls = fake_gemini(monkeypatch, [good])
+    bot.gemini_cache.entries.clear() # Fresh process, only the disk copy is left
+    assert run(bot.classify_file_names([NAME])) == [good]
+    assert len(calls) == 1
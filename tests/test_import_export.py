@@ -0,0 +1,74 @@
+import json
+
+from aiohttp.test_utils import TestClient, TestServer
+
+import bot
+
+
+def post_import(run, name, lines):
+    async def go():
+        async with TestClient(TestServer(bot.web_app)) as client:
+            response = await client.post(f"/api/import/{name}?secret={bot.API_SECRET_KEY}", data="\n".join(lines).encode())
+            return response.status, await response.json()
+    return run(go())
+
+
+def group_line(file_name):
+    return json.dumps({"groupName": "Jawan", "languages": {"Hindi": {"720p": {"fileId": "F1", "fileName": file_name, "fileType": "video"}}}})
+
+
+def test_import_skips_non_string_file_name(run):
+    bot.search_index.ensure_built()
+    status, body = post_import(run, "files", [group_line(123), group_line("Jawan.720p.mkv")])
+    assert status == 200
+    assert body["imported"] == 1
+    assert body["skipped"] == 1
+    assert body["errors"][0]["line"] == 1
+    assert bot.files_store.get("jawan")["languages"]["Hindi"]["720p"]["fileName"] == "Jawan.720p.mkv"
+
+
+def test_import_skips_bad_file_name_before_index_is_built(run):
+    status, body = post_import(run, "files", [group_line(["x"])])
+    assert status == 200
+    assert body["skipped"] == 1
+    assert "jawan" not in bot.files_store
+    bot.search_index.ensure_built() # Would raise on a stored non-string name
+
+
+def test_import_skips_blank_language_or_quality(run):
+    line = json.dumps({"groupName": "Jawan", "languages": {" ": {"720p": {"fileId": "F1", "fileName": "a.mkv"}}}})
+    status, body = post_import(run, "files", [line])
+    assert body["skipped"] == 1
+    assert "jawan" not in bot.files_store
+
+
+def test_flat_rows_default_file_name(run):
+    line = json.dumps({"groupName": "Jawan", "lang": "Hindi", "quality": "720p", "fileId": "F1"})
+    status, body = post_import(run, "files", [line])
+    assert body["imported"] == 1
+    assert bot.files_store.get("jawan")["languages"]["Hindi"]["720p"]["fileName"] == "Untitled"
+
+
+def test_popularity_import_keeps_clicks_recorded_meanwhile(run):
+    tracker = bot.popularity_tracker
+    tracker.__init__()
+    task = tracker._task = bot.bot_app.loop.create_future() # Stands in for the flush loop
+    imported = {"groupName": "Jawan", "lang": "Hindi", "quality": "720p", "count": 5}
+
+    async def upload():
+        yield json.dumps(imported).encode() + b"\n"
+        tracker.record("Pathaan", "Hindi", "1080p") # Clicked while the upload is in flight
+        yield json.dumps({**imported, "groupName": "Dunki"}).encode() + b"\n"
+
+    async def go():
+        async with TestClient(TestServer(bot.web_app)) as client:
+            response = await client.post(f"/api/import/popularity?secret={bot.API_SECRET_KEY}", data=upload())
+            return response.status, await response.json()
+    status, body = run(go())
+
+    assert status == 200 and body["imported"] == 2
+    assert tracker._task is task
+    assert bot.popularity_store.get(bot.popularity_key("Pathaan", "Hindi", "1080p"))["count"] == 1
+    assert {item["groupName"] for item in tracker.trending("lastDay")} == {"Pathaan"}
+    tracker.close()
+    assert task.cancelled()
@@ -0,0 +1,39 @@
+import pytest
+
+import bot
+
+
+@pytest.mark.parametrize("file_name, title", [
+    ("Jawan.2023.Hindi.1080p.WEB-DL.x264-GRP.mkv", "Jawan"),
+    ("Jawan Hindi 720p.mkv", "Jawan"),
+    ("New Amsterdam S01E02 English 720p.mkv", "New Amsterdam S01E02"),
+    ("It 2017 English 1080p.mkv", "It"),
+    ("Hindi Medium 2017 Hindi 720p.mkv", "Hindi Medium"),
+])
+def test_title_is_trusted(file_name, title):
+    parsed = bot.parse_release_name(file_name)
+    assert parsed["groupName"] == title
+    assert parsed["confidence"] >= bot.PARSER_MIN_CONFIDENCE
+
+
+# Right title or not, these are for the AI to confirm
+@pytest.mark.parametrize("file_name, title", [
+    ("The.Web.2023.1080p.Hindi.mkv", "The Web"),
+    ("Mission.Cam.2023.720p.Hindi.mkv", "Mission Cam"),
+    ("Dark.Web.2019.1080p.Hindi.mkv", "Dark Web"),
+    ("Tom.And.Jerry.The.Movie.1992.720p.Hindi.mkv", "Tom And Jerry The"),
+    ("Jawan Full Movie Hindi 720p.mkv", "Jawan"),
+    ("Jawan HD Hindi 720p.mkv", "Jawan"),
+    ("Jawan.WEBRip.720p.Hindi.mkv", "Jawan WEBRip"),
+    ("Watch Jawan Online Hindi 720p.mkv", "Watch Jawan"),
+])
+def test_doubtful_title_goes_to_ai(file_name, title):
+    parsed = bot.parse_release_name(file_name)
+    assert parsed["groupName"] == title
+    assert parsed["confidence"] < bot.PARSER_MIN_CONFIDENCE
+
+
+def test_tags_after_the_anchor():
+    parsed = bot.parse_release_name("Jawan.2023.Hindi.1080p.WEB-DL.x264-GRP.mkv")
+    assert (parsed["year"], parsed["lang"], parsed["quality"], parsed["source"], parsed["codec"], parsed["releaseGroup"]) == \
+        (2023, "Hindi", "1080p", "WEB-DL", "x264", "GRP")
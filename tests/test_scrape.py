@@ -0,0 +1,59 @@
+from types import SimpleNamespace
+
+import bot
+
+
+class FakeHistory:
+    def __init__(self, message_ids):
+        self.message_ids = message_ids
+        self.paged = []
+
+    async def get_chat(self, chat_id):
+        return SimpleNamespace(id=-100) # Every spelling resolves to the same channel
+
+    async def get_chat_history(self, chat_id, offset_id=0):
+        for message_id in sorted(self.message_ids, reverse=True):
+            if offset_id and message_id >= offset_id: continue
+            self.paged.append(message_id)
+            yield SimpleNamespace(id=message_id, document=None, video=None)
+
+
+class FakeStatus:
+    async def edit(self, text):
+        return self
+
+
+def test_repeat_runs_stay_incremental(run, monkeypatch):
+    history = FakeHistory(range(1, 11))
+    async def ensure_user_app():
+        return history
+    monkeypatch.setattr(bot, "ensure_user_app", ensure_user_app)
+
+    for expected_paged in (10, 1, 1): # Later runs stop at the first already-indexed post
+        history.paged.clear()
+        run(bot.ScrapeJob.for_channel(-100, FakeStatus()).run())
+        assert len(history.paged) == expected_paged
+        state = bot.scrape_jobs_store.get("-100")
+        assert state["status"] == "done"
+        assert state["floorId"] == 10
+
+    history.message_ids = range(1, 13)
+    history.paged.clear()
+    run(bot.ScrapeJob.for_channel(-100, FakeStatus()).run())
+    assert history.paged == [12, 11, 10]
+    assert bot.scrape_jobs_store.get("-100")["floorId"] == 12
+
+
+def test_any_spelling_of_a_channel_resumes_one_job(run, monkeypatch):
+    history = FakeHistory(range(1, 11))
+    async def ensure_user_app():
+        return history
+    monkeypatch.setattr(bot, "ensure_user_app", ensure_user_app)
+
+    run(bot.run_scrape_job("@channel", FakeStatus()))
+    history.message_ids = range(1, 13)
+    history.paged.clear()
+    run(bot.run_scrape_job("https://t.me/channel", FakeStatus()))
+    assert history.paged == [12, 11, 10]
+    assert list(bot.scrape_jobs_store.data) == ["-100"]
+    assert bot.unfinished_scrape_jobs() == []
@@ -0,0 +1,28 @@
+import bot
+
+
+def test_replica_catches_up_across_a_journal_rotation(run, monkeypatch, tmp_path):
+    monkeypatch.chdir(tmp_path)
+    writer = bot.JsonBackend("files", bot.DB_PATH_FILES)
+    def group(n, padding=""):
+        return {"groupName": f"Movie {n}{padding}", "languages": {}}
+    run(writer.write([["s", f"movie-{n}", group(n)] for n in range(30)]))
+
+    # The replica syncs after the snapshot is replaced but before the journal is rotated
+    monkeypatch.setattr(writer, "_rotate_journal", lambda: None)
+    writer._write_snapshot({f"movie-{n}": group(n) for n in range(30)})
+    replica = bot.CatalogReplica("json")
+    replica.sync()
+    assert len(bot.files_store) == 30
+
+    monkeypatch.undo()
+    monkeypatch.chdir(tmp_path)
+    writer._rotate_journal()
+    run(writer.write([["s", f"movie-{n}", group(n, " extended cut" * 5)] for n in range(30, 50)]))
+    replica.sync()
+    assert len(bot.files_store) == 50
+
+    run(writer.write([["d", "movie-0"]]))
+    replica.sync()
+    assert len(bot.files_store) == 49
+    assert bot.search_index.search("movie 49")[0][1] == "movie-49"
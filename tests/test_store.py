@@ -0,0 +1,79 @@
+import bot
+
+
+def test_failing_watcher_does_not_stop_journaling():
+    store = bot.ResidentStore(bot.JsonBackend("watched", "./watched.json"))
+    seen = []
+    def broken(op):
+        raise TypeError("bad value")
+    store.watch(broken)
+    store.watch(seen.append)
+    store.set("a", 1)
+    assert store.get("a") == 1
+    assert store._pending == [["s", "a", 1]]
+    assert seen == [["s", "a", 1]]
+
+
+def test_sqlite_catalog_searches_through_fts(run, tmp_path):
+    backend = bot.SqliteBackend("files", str(tmp_path / "bot.sqlite3"), catalog=True)
+    def group(name, file_name):
+        return {"groupName": name, "languages": {"Hindi": {"720p": {"fileId": "F", "fileName": file_name}}}}
+    backend.write_sync([
+        ["s", "jawan", group("Jawan", "Jawan.2023.Hindi.720p.mkv")],
+        ["s", "jawan-returns", group("Jawan Returns", "JR.720p.mkv")],
+        ["s", "pathaan", group("Pathaan", "Pathaan.Señor.Cut.mkv")],
+        ["s", "old", group("Jawani", "x.mkv")],
+        ["d", "old"],
+    ])
+    assert backend.load(None)[0].keys() == {"jawan", "jawan-returns", "pathaan"}
+    assert [key for score, key in run(backend.search_titles("jaw"))] == ["jawan", "jawan-returns"]
+    assert [key for score, key in run(backend.search_titles("senor cut"))] == ["pathaan"] # File names, folded
+    assert run(backend.search_titles("jawani")) == []
+    backend.write_sync([["c"]])
+    assert run(backend.search_titles("jawan")) == []
+    assert [row[0] for row in backend.connect().execute("SELECT key FROM catalog_changes ORDER BY seq")][:3] == ["jawan", "jawan-returns", "pathaan"]
+    backend.close()
+
+
+class SlowBackend(bot.JsonBackend):
+    def __init__(self, path):
+        super().__init__("slow", path)
+        self.started = bot.asyncio.Event()
+        self.written, self.closed_after = [], None
+
+    async def write(self, ops):
+        self.started.set()
+        await bot.asyncio.sleep(0.05) # Stands in for the write thread
+        self.written.extend(ops)
+
+    def close(self):
+        self.closed_after = list(self.written)
+        super().close()
+
+
+def test_close_waits_for_the_write_in_progress(run, tmp_path):
+    backend = SlowBackend(str(tmp_path / "slow.json"))
+    store = bot.ResidentStore(backend)
+    async def go():
+        store.start()
+        store.set("a", 1)
+        store._wake.set()
+        await backend.started.wait()
+        store.set("b", 2)
+        await store.close()
+    run(go())
+    assert backend.closed_after == [["s", "a", 1], ["s", "b", 2]]
+    assert store._pending == []
+
+
+def test_cancelled_write_keeps_its_ops(run, tmp_path):
+    backend = SlowBackend(str(tmp_path / "slow.json"))
+    store = bot.ResidentStore(backend)
+    async def go():
+        store.set("a", 1)
+        flush = bot.asyncio.ensure_future(store.flush())
+        await backend.started.wait()
+        flush.cancel()
+        await bot.asyncio.gather(flush, return_exceptions=True)
+    run(go())
+    assert store._pending == [["s", "a", 1]]